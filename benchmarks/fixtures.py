@@ -0,0 +1,73 @@
+import contextlib
+import io
+import os
+
+from database import queries
+from database.database import DatabaseManager
+
+## Local stand-ins for the plant database, shared by the benchmarks. Everything lives in a
+## throwaway directory, so nothing here touches config.cfg or the live MySQL server.
+
+FIRST_LOT = 10001
+
+
+def write_config(directory, image_server_url=None, pool_size=2):
+    ## Writes a config.cfg for a local SQLite database (and, optionally, a stub image server)
+    config_path = os.path.join(directory, 'config.cfg')
+    with open(config_path, 'w') as f:
+        f.write("[DatabaseSettings]\n"
+                "use_sqlite = True\n"
+                "use_external_db = False\n"
+                f"sqlite_path = {os.path.join(directory, 'benchmark.db')}\n"
+                f"pool_size = {pool_size}\n")
+        if image_server_url:
+            f.write("\n[ImageServer]\n"
+                    f"base_url = {image_server_url}\n"
+                    "retries = 0\n")
+        f.write("\n[Metrics]\n"
+                "enabled = False\n")
+    return config_path
+
+
+def blend_code(index):
+    return f"{1000 + index}B"
+
+
+def blend_rows(blend_count, variant=0):
+    ## (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight) tuples.
+    ## A different variant changes every tenth blend, for re-import benchmarks.
+    rows = []
+    for i in range(blend_count):
+        changed = variant and i % 10 == 0
+        rows.append((blend_code(i), f"Product {i}", 100 + i % 400, round(50 + i * 0.5, 1),
+                     '16-May', round(300 + i % 700 + (variant if changed else 0), 1)))
+    return rows
+
+
+def lot_image_url(image_server_url, blend, lot_number):
+    return f"{image_server_url.rstrip('/')}/images/{blend}/{lot_number}"
+
+
+def seed_database(config_path, blend_count=50, lots_per_blend=200, image_server_url='http://127.0.0.1:0'):
+    ## Creates the schema and fills it with blends and their lot history.
+    ## Returns an open DatabaseManager; the caller closes it.
+    with contextlib.redirect_stdout(io.StringIO()):  # migration progress
+        db_manager = DatabaseManager(config_path)
+    db_manager.upsert_blends(blend_rows(blend_count))
+    lots = [(blend_code(i), lot, lot_image_url(image_server_url, blend_code(i), lot), "", None)
+            for i in range(blend_count)
+            for lot in range(FIRST_LOT, FIRST_LOT + lots_per_blend)]
+    with db_manager.statements(commit=True) as db:
+        db.executemany(queries.INSERT_LOT_IMAGE, lots)
+        if lots_per_blend:
+            db.executemany(queries.SEED_LOT_SEQUENCE,
+                           [(blend_code(i), FIRST_LOT + lots_per_blend - 1) for i in range(blend_count)])
+    return db_manager
+
+
+def write_blend_csv(path, rows):
+    ## Writes rows in the layout of the Product Information export read by update_blend_info.py
+    with open(path, 'w', newline='') as f:
+        f.write("Code,PRODUCT,Tablets Amount,Kilos to Produce,Tablet Size,Tablet weight\n")
+        for code, product, tablets_amount, kilos, tablet_size, tablet_weight in rows:
+            f.write(f"{code},{product},{tablets_amount},{kilos},{tablet_size},{tablet_weight}\n")
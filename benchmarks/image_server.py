@@ -0,0 +1,147 @@
+## Local stand-in for the lot image server.
+##   GET  /images/<blend>/<lot>  returns a generated JPEG (ETag / If-None-Match supported)
+##   POST /upload                 reads the multipart body and answers {"image_path": ...}
+## Every response waits latency_ms first, to imitate the plant network.
+##
+## Used by run_benchmarks.py, or on its own to point a station at:
+##     python -m benchmarks.image_server --port 25050 --latency-ms 80 --size 4032x3024
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from PIL import Image
+
+IMAGE_PATH = re.compile(r'^/images/([^/]+)/(\d+)$')
+
+
+def make_jpeg(size, quality=90):
+    ## A photo-like test image: smooth gradients plus sensor-style noise, so it
+    ## compresses (and decodes) more like a phone picture than a flat colour would
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 24)
+    red = Image.blend(gradient, noise, 0.3)
+    green = Image.blend(gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), noise, 0.3)
+    blue = Image.radial_gradient('L').resize(size)
+    out = BytesIO()
+    Image.merge('RGB', (red, green, blue)).save(out, 'JPEG', quality=quality)
+    return out.getvalue()
+
+
+class ImageServerStub:
+    """Threaded stub image server, started on a free local port unless one is given."""
+
+    def __init__(self, latency_ms=0, image_size=(1600, 1200), port=0):
+        self.latency_ms = latency_ms
+        self.image = make_jpeg(image_size)
+        self.etag = '"' + hashlib.md5(self.image).hexdigest() + '"'
+        self.uploads = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="image-server-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        ## Serves on the calling thread until interrupted
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real server
+
+            def do_GET(self):
+                stub._wait()
+                if not IMAGE_PATH.match(self.path):
+                    self._reply(404, b'Not found', 'text/plain')
+                elif self.headers.get('If-None-Match') == stub.etag:
+                    self._reply(304, b'', None)
+                else:
+                    self._reply(200, stub.image, 'image/jpeg')
+
+            def do_POST(self):
+                stub._wait()
+                length = int(self.headers.get('Content-Length', 0))
+                remaining = length
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 64 * 1024))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                if self.path != '/upload':
+                    self._reply(404, b'Not found', 'text/plain')
+                    return
+                with stub._lock:
+                    stub.uploads += 1
+                    stub.bytes_received += length
+                    image_path = f"{stub.url}/images/uploaded/{stub.uploads}"
+                self._reply(200, json.dumps({'image_path': image_path}).encode('utf-8'), 'application/json')
+
+            def _reply(self, status, body, content_type):
+                self.send_response(status)
+                if content_type:
+                    self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', stub.etag)
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _wait(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve generated lot images locally.")
+    parser.add_argument('--port', type=int, default=25050)
+    parser.add_argument('--latency-ms', type=float, default=0, help="Delay before every response")
+    parser.add_argument('--size', type=parse_size, default=(1600, 1200), help="Image size, e.g. 4032x3024")
+    args = parser.parse_args()
+
+    stub = ImageServerStub(args.latency_ms, args.size, args.port)
+    print(f"Serving {len(stub.image) // 1024} KB images on {stub.url} (Ctrl+C to stop)")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
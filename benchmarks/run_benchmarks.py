@@ -0,0 +1,212 @@
+## Reproducible benchmarks for the operator-facing paths, run against a seeded local
+## SQLite database and the stub image server instead of the plant systems.
+## Results are written as JSON so runs can be compared over time.
+##
+## Run from the repository root:
+##     python -m benchmarks.run_benchmarks --output results.json
+##     python -m benchmarks.run_benchmarks --only load_blend,decode_render --latency-ms 80
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fixtures
+from benchmarks.image_server import ImageServerStub, make_jpeg, parse_size
+from imaging.fetch import fetch_image_bytes
+from imaging.image_cache import ImageCache, lot_cache_key
+from imaging.render import render_lot_image
+from imaging.upload import MultipartBody, prepare_upload
+from instrumentation import metrics
+from network import http_client
+import update_blend_info
+
+PHONE_PHOTO_SIZE = (4032, 3024)
+
+
+def measure(func, iterations, warmup=1):
+    ## Calls func(i) warmup + iterations times and summarises the timed calls in milliseconds
+    for i in range(warmup):
+        func(i)
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        func(warmup + i)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'min_ms': round(samples[0], 3),
+        'max_ms': round(samples[-1], 3)
+    }
+
+
+def bench_load_blend(env, iterations):
+    ## What load_blend_data does when a blend is picked, minus the Tk widgets:
+    ## blend info, latest lot, first page of the lot list, then download and render the past lot image
+    db_manager, blend_count = env['db_manager'], env['blend_count']
+
+    def load(i, cache=None):
+        blend = fixtures.blend_code(i % blend_count)
+        db_manager.fetch_blend_info(blend)
+        image_path, lot_number = db_manager.fetch_image_info_for_blend(blend)
+        db_manager.fetch_lot_page(blend)
+        data = fetch_image_bytes(image_path, cache, lot_cache_key(blend, lot_number))
+        render_lot_image(data, f"PAST (Lot {lot_number})", "green")
+
+    cache = ImageCache(os.path.join(env['directory'], 'image_cache'), 512 * 1024 * 1024, 3600)
+    return {
+        'uncached': measure(load, iterations),
+        # Every blend's image is already on disk after the warm-up pass
+        'disk_cached': measure(lambda i: load(i, cache), iterations, warmup=blend_count)
+    }
+
+
+def bench_csv_import(env, iterations):
+    ## update_blend_info.insert_data_from_csv: a first import into an empty catalog,
+    ## then re-imports where every tenth blend has changed
+    directory, blend_count = env['directory'], env['blend_count'] * 10
+    csv_paths = []
+    for variant in (0, 1, 2):
+        path = os.path.join(directory, f'blends_{variant}.csv')
+        fixtures.write_blend_csv(path, fixtures.blend_rows(blend_count, variant))
+        csv_paths.append(path)
+
+    os.makedirs(os.path.join(directory, 'csv'))
+    config_path = fixtures.write_config(os.path.join(directory, 'csv'))
+    db_manager = fixtures.seed_database(config_path, blend_count=0, lots_per_blend=0)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            first = measure(lambda i: update_blend_info.insert_data_from_csv(db_manager, csv_paths[0]),
+                            1, warmup=0)
+            # Alternates between two variants so each run really writes blend_count / 10 rows
+            reimport = measure(lambda i: update_blend_info.insert_data_from_csv(db_manager, csv_paths[1 + i % 2]),
+                               iterations)
+    finally:
+        db_manager.close()
+    return {'rows': blend_count, 'initial_import': first, 'reimport_10pct_changed': reimport}
+
+
+def bench_decode_render(env, iterations):
+    ## render_lot_image on its own, for a full-size phone photo and the stub's image size
+    results = {}
+    for size in (PHONE_PHOTO_SIZE, env['image_size']):
+        data = make_jpeg(size)
+        results[f"{size[0]}x{size[1]}"] = dict(
+            measure(lambda i: render_lot_image(data, "PAST (Lot 10001)", "green"), iterations),
+            jpeg_bytes=len(data))
+    return results
+
+
+def bench_lot_allocation(env, iterations):
+    ## Single-station allocate_lot_number; see stress_lot_allocation.py for contention
+    db_manager = env['db_manager']
+    return measure(lambda i: db_manager.allocate_lot_number(fixtures.blend_code(0)), iterations)
+
+
+def bench_upload(env, iterations):
+    ## What ImageUploader does per upload: downscale and recompress a phone photo, then POST it
+    photo_path = os.path.join(env['directory'], 'photo.jpg')
+    with open(photo_path, 'wb') as f:
+        f.write(make_jpeg(PHONE_PHOTO_SIZE))
+
+    def upload(i):
+        filename, payload = prepare_upload(photo_path, 2048, 85)
+        body = MultipartBody({'blend_id': fixtures.blend_code(0), 'lot_number': str(i)}, 'image', filename, payload)
+        response = http_client.post(http_client.server_url('/upload'), data=body,
+                                    headers={'Content-Type': body.content_type})
+        response.raise_for_status()
+
+    return measure(upload, iterations)
+
+
+BENCHMARKS = {
+    'load_blend': bench_load_blend,
+    'csv_import': bench_csv_import,
+    'decode_render': bench_decode_render,
+    'lot_allocation': bench_lot_allocation,
+    'upload': bench_upload
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, blend_count, lots_per_blend, latency_ms, image_size, iterations):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, ImageServerStub(latency_ms, image_size) as server:
+        config_path = fixtures.write_config(directory, image_server_url=server.url)
+        http_client.configure(config_path)
+        db_manager = fixtures.seed_database(config_path, blend_count, lots_per_blend, server.url)
+        env = {'directory': directory, 'db_manager': db_manager, 'blend_count': blend_count,
+               'image_size': image_size}
+        metrics.snapshot(reset=True)
+        try:
+            for name in names:
+                print(f"Running {name}...", file=sys.stderr)
+                results[name] = BENCHMARKS[name](env, iterations)
+        finally:
+            db_manager.close()
+    # Per-operation breakdown from the same spans the app records on the floor
+    breakdown = {operation: {'count': histogram.count, 'p50_ms': round(histogram.percentile(0.5), 3),
+                             'p95_ms': round(histogram.percentile(0.95), 3),
+                             'p99_ms': round(histogram.percentile(0.99), 3)}
+                 for operation, histogram in sorted(metrics.snapshot().items())}
+    return results, breakdown
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's hot paths against local stand-ins.")
+    parser.add_argument('--only', help=f"Comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--blends', type=int, default=50, help="Blends in the seeded database (default: 50)")
+    parser.add_argument('--lots', type=int, default=500, help="Lots per blend (default: 500)")
+    parser.add_argument('--iterations', type=int, default=30, help="Timed runs per benchmark (default: 30)")
+    parser.add_argument('--latency-ms', type=float, default=0, help="Stub image server delay per request")
+    parser.add_argument('--image-size', type=parse_size, default=(1600, 1200),
+                        help="Size of the served lot images (default: 1600x1200)")
+    parser.add_argument('--output', help="Write the JSON results here instead of to stdout")
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+    started = time.time()
+    results, breakdown = run(names, args.blends, args.lots, args.latency_ms, args.image_size, args.iterations)
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'blends': args.blends, 'lots_per_blend': args.lots, 'iterations': args.iterations,
+                       'latency_ms': args.latency_ms, 'image_size': list(args.image_size)},
+        'benchmarks': results,
+        'operations': breakdown
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
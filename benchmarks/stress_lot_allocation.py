@@ -0,0 +1,106 @@
+## Multi-process stress harness for DatabaseManager.allocate_lot_number.
+## Simulates many press stations allocating lots for the same blends at once against
+## a throwaway local SQLite database, then checks that no lot number was handed out
+## twice and that every blend's numbers are gap-free.
+##
+## Run from the repository root:
+##     python -m benchmarks.stress_lot_allocation --stations 8 --allocations 200
+
+import argparse
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks.fixtures import write_config
+from database import queries
+from database.database import DatabaseManager
+
+EXISTING_BLEND = '3991B'  # has lot history before the run starts
+FRESH_BLEND = '1229B'     # has none, so stations race to start its sequence
+EXISTING_LAST_LOT = 10400
+FRESH_FIRST_LOT = 10001
+
+
+def seed(config_path):
+    db_manager = DatabaseManager(config_path)
+    db_manager.insert_blend(EXISTING_BLEND, 'Blueberry', 500, 180, '16-May', 360)
+    db_manager.insert_blend(FRESH_BLEND, 'Zinc', 350, 227.5, '16-Jul', 650)
+    db_manager.insert_lot_image(EXISTING_BLEND, EXISTING_LAST_LOT, 'seed')
+    # Start the existing blend's sequence from its history, as the migration does
+    with db_manager.statements(commit=True) as db:
+        db.execute(queries.SEED_LOT_SEQUENCE, (EXISTING_BLEND, EXISTING_LAST_LOT))
+    db_manager.close()
+
+
+def station(config_path, allocations, seed_value, results):
+    db_manager = DatabaseManager(config_path)
+    rng = random.Random(seed_value)
+    allocated = []
+    for _ in range(allocations):
+        blend = rng.choice((EXISTING_BLEND, FRESH_BLEND))
+        lot = db_manager.allocate_lot_number(blend)
+        if lot is None:
+            # First allocation for this blend: every station offers the same starting lot
+            lot = db_manager.allocate_lot_number(blend, first_lot=FRESH_FIRST_LOT)
+        allocated.append((blend, lot))
+    db_manager.close()
+    results.put(allocated)
+
+
+def check(allocated):
+    by_blend = defaultdict(list)
+    for blend, lot in allocated:
+        by_blend[blend].append(lot)
+    errors = []
+    expected_start = {EXISTING_BLEND: EXISTING_LAST_LOT + 1, FRESH_BLEND: FRESH_FIRST_LOT}
+    for blend, lots in by_blend.items():
+        duplicates = len(lots) - len(set(lots))
+        if duplicates:
+            errors.append(f"{blend}: {duplicates} duplicate lot numbers")
+        expected = list(range(expected_start[blend], expected_start[blend] + len(lots)))
+        if sorted(lots) != expected:
+            errors.append(f"{blend}: lots are not the contiguous range starting at {expected_start[blend]}")
+    return by_blend, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test atomic lot number allocation.")
+    parser.add_argument('--stations', type=int, default=8, help="Concurrent processes (default: 8)")
+    parser.add_argument('--allocations', type=int, default=200, help="Allocations per process (default: 200)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = write_config(directory)
+        seed(config_path)
+
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        processes = [context.Process(target=station, args=(config_path, args.allocations, i, results))
+                     for i in range(args.stations)]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        allocated = []
+        for _ in processes:
+            allocated.extend(results.get(timeout=300))
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+    by_blend, errors = check(allocated)
+    print(f"{len(allocated)} allocations from {args.stations} stations in {elapsed:.2f}s "
+          f"({len(allocated) / elapsed:.0f}/s)")
+    for blend, lots in sorted(by_blend.items()):
+        print(f"  {blend}: {len(lots)} lots, {min(lots)}-{max(lots)}")
+    if errors or any(process.exitcode != 0 for process in processes):
+        for error in errors:
+            print(f"FAILED: {error}")
+        sys.exit(1)
+    print("OK: every lot number was allocated exactly once")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,24 @@
-import sqlite3
-
-import mysql.connector
+import base64
 import configparser
+import threading
+import time
+from contextlib import contextmanager
+
+from database import migrations, queries
+from database.journal import WriteJournal
+from database.pool import MySQLConnectionPool, SQLiteConnectionPool
+from database.queries import PreparedStatementCache, StatementRunner
+from instrumentation import metrics
 
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, config_path='config.cfg'):
         ## load stored config from file
         config = configparser.ConfigParser()
-        config.read('config.cfg')
+        config.read(config_path)
         ## Decide whether to locally or externally store data
         self.use_sqlite = config.getboolean('DatabaseSettings', 'use_sqlite')
         self.use_external_db = config.getboolean('DatabaseSettings', 'use_external_db')
+        self.dialect = 'sqlite' if self.use_sqlite else 'mysql'
         ## Load external database connection, if configured
         if self.use_external_db:
             self.external_db_config = {
@@ -23,71 +31,157 @@ class DatabaseManager:
             # Otherwise resort to SQLite storage (local-only)
             self.external_db_config = None
 
-        self.db_path = "qc_application.db"
+        ## Connections are pooled so background workers can query in parallel
+        self.pool_size = config.getint('DatabaseSettings', 'pool_size', fallback=5)
+        self.db_path = config.get('DatabaseSettings', 'sqlite_path', fallback="qc_application.db")
+        ## The blend catalog is served from memory; its version stamp is re-checked at most this often
+        self.catalog_check_interval = config.getfloat('DatabaseSettings', 'catalog_check_interval', fallback=300)
+        self._catalog = None  # code -> (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight)
+        self._valid_blends = []
+        self._catalog_version = None
+        self._catalog_checked_at = 0
+        self._catalog_lock = threading.Lock()
+        self._prepared = PreparedStatementCache()
+        ## Lot inserts and confirmations go through a local write-behind journal when
+        ## using the external database, so a slow or unreachable server never blocks the operator
+        self.use_journal = (not self.use_sqlite and self.use_external_db
+                            and config.getboolean('WriteJournal', 'enabled', fallback=True))
+        self.journal_settings = {
+            'path': config.get('WriteJournal', 'path', fallback='write_journal.db'),
+            'flush_interval': config.getfloat('WriteJournal', 'flush_interval', fallback=2),
+            'batch_size': config.getint('WriteJournal', 'batch_size', fallback=50)
+        }
+        self.journal = None
         self.initialize_database()
 
     def initialize_database(self):
         if self.use_sqlite:
-            self.conn = sqlite3.connect(self.db_path)
-            self.cursor = self.conn.cursor()
+            self.pool = SQLiteConnectionPool(self.db_path, self.pool_size)
         elif self.use_external_db and self.external_db_config:
-            self.conn = mysql.connector.connect(**self.external_db_config)
-            self.cursor = self.conn.cursor()
+            self.pool = MySQLConnectionPool(self.external_db_config, self.pool_size)
         else:
             # Initialize file-based storage system
-            pass
-        self.create_tables()
-
-    def create_tables(self):
-        users_table = '''CREATE TABLE IF NOT EXISTS users
-                         (username VARCHAR(255) PRIMARY KEY, pin TEXT) ENGINE=InnoDB;'''
-        blends_table = '''CREATE TABLE IF NOT EXISTS blends
-                          (code VARCHAR(255) PRIMARY KEY, product TEXT, tablets_amount INTEGER, kilos_to_produce REAL, tablet_size VARCHAR(255), tablet_weight REAL) ENGINE=InnoDB;'''
-        lot_images_table = '''CREATE TABLE IF NOT EXISTS lot_images
-                              (blend_code VARCHAR(255), lot_number VARCHAR(255), image_path TEXT, FOREIGN KEY(blend_code) REFERENCES blends(code),
-                              confirmed_by VARCHAR(255)) ENGINE=InnoDB;'''
+            self.pool = None
+        self.migrate_schema()
+        if self.use_journal:
+            self.journal = WriteJournal(apply_batch=self._apply_journal_batch,
+                                        is_unavailable=self.pool.is_connection_error, **self.journal_settings)
+            # Replays anything left over from the last session, then keeps up with new writes
+            self.journal.start()
+
+    @contextmanager
+    def connection(self):
+        ## Checks a connection out of the pool for the duration of one operation
+        with metrics.span('db.connection_wait'):
+            conn = self.pool.get_connection()
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    @contextmanager
+    def statements(self, commit=False):
+        ## Yields a StatementRunner that executes the Query objects from database/queries.py,
+        ## rendered for the active backend. With commit=True the block runs as one transaction,
+        ## committed on success and rolled back if anything raises.
+        with self.connection() as conn:
+            if commit:
+                self.pool.begin(conn)
+            try:
+                yield StatementRunner(conn, self.dialect, self._prepared)
+                if commit:
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def migrate_schema(self):
+        ## Creates or upgrades the tables, see database/migrations.py
         if self.use_sqlite or self.use_external_db:
-            self.cursor.execute(users_table)
-            self.cursor.execute(blends_table)
-            self.cursor.execute(lot_images_table)
-            self.conn.commit()
+            migrations.migrate(self)
         else:
             # Create tables in file-based storage, if applicable
             pass
 
+    @metrics.timed('db.fetch_all_users')
     def fetch_all_users(self):
-        self.cursor.execute("SELECT username FROM users")
-        columns = [col[0] for col in self.cursor.description]
-        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+        with self.statements() as db:
+            return [{'username': row[0]} for row in db.fetchall(queries.FETCH_ALL_USERS)]
 
+    @metrics.timed('db.authenticate_user')
     def authenticate_user(self, username, pin):
-        self.cursor.execute("SELECT * FROM users WHERE username = %s AND pin = %s", (username, pin))
-        return self.cursor.fetchone() is not None
+        with self.statements() as db:
+            return db.fetchone(queries.AUTHENTICATE_USER, (username, pin)) is not None
 
     def close(self):
-        if self.use_sqlite or self.use_external_db:
-            self.conn.close()
+        if self.journal is not None:
+            self.journal.stop()
+        if self.pool is not None:
+            self.pool.close()
 
     def insert_blend(self, code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight):
-        if self.use_sqlite:
-            query = '''INSERT INTO blends (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight)
-                       VALUES (?, ?, ?, ?, ?, ?)'''
-        else:
-            query = '''INSERT INTO blends (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight)
-                               VALUES (%s, %s, %s, %s, %s, %s)'''
         try:
-            self.cursor.execute(query, (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight))
-            self.conn.commit()
+            with self.statements(commit=True) as db:
+                db.execute(queries.INSERT_BLEND, (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight))
+                self._bump_catalog_version(db)
         except Exception as e:
             print(f"An error occurred: {e}")
-            self.conn.rollback()
 
-    def fetch_blend_info(self, blend_code):
-        query = '''SELECT * FROM blends WHERE code = %s'''
+    def fetch_all_blends(self):
+        ## Returns {code: (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight)}
+        with self.statements() as db:
+            return {row[0]: tuple(row) for row in db.fetchall(queries.FETCH_ALL_BLENDS)}
 
+    @metrics.timed('db.upsert_blends')
+    def upsert_blends(self, rows):
+        ## Inserts or updates many blends in a single transaction.
+        ## rows are (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight) tuples.
+        if not rows:
+            return True
         try:
-            self.cursor.execute(query, (blend_code,))
-            result = self.cursor.fetchone()
+            with self.statements(commit=True) as db:
+                # mysql-connector rewrites this into one multi-row INSERT, i.e. a single round trip
+                db.executemany(queries.UPSERT_BLENDS, rows)
+                self._bump_catalog_version(db)
+            return True
+        except Exception as e:
+            print(f"An error occurred while updating blends, nothing was changed: {e}")
+            return False
+
+    def _bump_catalog_version(self, db):
+        ## Tells every station that its in-memory blend catalog is out of date.
+        ## Runs inside the caller's transaction, so the stamp moves together with the data.
+        db.execute(queries.BUMP_CATALOG_VERSION)
+        # Force this station to re-check the stamp on its next lookup
+        self._catalog_checked_at = 0
+
+    def _blend_catalog(self):
+        ## Returns the in-memory catalog, reloading it only when the version stamp has moved
+        with self._catalog_lock:
+            now = time.monotonic()
+            if self._catalog is not None and now - self._catalog_checked_at < self.catalog_check_interval:
+                return self._catalog
+            try:
+                with self.statements() as db:
+                    row = db.fetchone(queries.FETCH_CATALOG_VERSION)
+                    version = row[0] if row else None
+                    if self._catalog is None or version != self._catalog_version:
+                        self._catalog = {row[0]: tuple(row) for row in db.fetchall(queries.FETCH_ALL_BLENDS)}
+                        self._valid_blends = [code for code, blend in self._catalog.items()
+                                              if blend[5] is not None and blend[5] > 0]
+                        self._catalog_version = version
+            except Exception as e:
+                if self._catalog is None:
+                    raise
+                # Keep serving the last good catalog through a database blip
+                print(f"Couldn't check the blend catalog version, using cached catalog: {e}")
+            self._catalog_checked_at = now
+            return self._catalog
+
+    @metrics.timed('db.fetch_blend_info')
+    def fetch_blend_info(self, blend_code):
+        try:
+            result = self._blend_catalog().get(blend_code)
 
             if result:
                 blend_info = {
@@ -106,86 +200,146 @@ class DatabaseManager:
             print(f"An error occurred while fetching blend info: {e}")
             return None
 
+    @metrics.timed('db.fetch_valid_blends')
     def fetch_valid_blends(self):
-        query = "SELECT code FROM blends WHERE tablet_weight IS NOT NULL AND tablet_weight > 0"
-        self.cursor.execute(query)
-        return [row[0] for row in self.cursor.fetchall()]
-
-    def create_image_table(self):
-        image_table = '''CREATE TABLE IF NOT EXISTS lot_images (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            blend_code VARCHAR(255),
-            lot_number INT,
-            result TEXT,
-            image_path TEXT,
-            FOREIGN KEY(blend_code) REFERENCES blends(code)
-        ) ENGINE=InnoDB;'''
-        self.cursor.execute(image_table)
-        self.conn.commit()
-
-    def find_next_lot(self, blend_id):
-        if self.use_sqlite:
-            query = "SELECT MAX(lot_number) FROM lot_images WHERE blend_code = ?"
-        else:
-            query = "SELECT MAX(lot_number) FROM lot_images WHERE blend_code = %s"
-        self.cursor.execute(query, (blend_id,))
-        result = self.cursor.fetchone()
-        if result and result[0] is not None:
-            # Convert the lot number to an integer before adding 1
-            return int(result[0]) + 1
-        else:
-            return 0  # Start with 1 if no lots are found
+        ## Blends with a usable tablet weight, from the in-memory catalog
+        self._blend_catalog()
+        return list(self._valid_blends)
 
-    def fetch_image_info_for_blend(self, blend_id):
-        if self.use_sqlite:
-            query = "SELECT image_path, lot_number FROM lot_images WHERE blend_code = ? ORDER BY lot_number DESC LIMIT 1"
-        else:  # Assuming MySQL/MariaDB for external DB
-            query = "SELECT image_path, lot_number FROM lot_images WHERE blend_code = %s ORDER BY lot_number DESC LIMIT 1"
+    def pending_write_count(self):
+        ## Lot uploads and confirmations still waiting in the journal for the database
+        if self.journal is None:
+            return 0
+        return self.journal.pending_count()
+
+    def _pending_lots(self, blend_id):
+        ## Lots uploaded on this station that the journal hasn't written yet, as {lot_number: image_path}
+        if self.journal is None:
+            return {}
+        return {payload['lot_number']: payload['image_path']
+                for _, _, payload in self.journal.pending('insert_lot_image')
+                if payload['blend_code'] == blend_id}
+
+    @metrics.timed('db.allocate_lot_number')
+    def allocate_lot_number(self, blend_code, first_lot=None):
+        ## Atomically reserves the next lot number for a blend, safe across stations.
+        ## The per-blend counter row is bumped and read back in one short transaction,
+        ## which only locks that row. Returns None if the blend has no lot history yet;
+        ## call again with the operator's first_lot to start its sequence there.
+        with self.statements(commit=True) as db:
+            if first_lot is not None:
+                # If another station started the sequence first, theirs wins and we take the next number
+                db.execute(queries.SEED_LOT_SEQUENCE, (blend_code, int(first_lot) - 1))
+            if db.execute(queries.BUMP_LOT_SEQUENCE, (blend_code,)) == 0:
+                return None
+            return db.fetchone(queries.FETCH_LOT_SEQUENCE, (blend_code,))[0]
 
-        self.cursor.execute(query, (blend_id,))
-        result = self.cursor.fetchone()
+    def release_lot_number(self, blend_code, lot_number):
+        ## Gives back a number from allocate_lot_number that was never used (e.g. the upload failed),
+        ## so the next upload gets it. Does nothing if another station has allocated since;
+        ## that number then stays a gap. Returns True if the number was released.
+        with self.statements(commit=True) as db:
+            return db.execute(queries.RELEASE_LOT_SEQUENCE, (blend_code, int(lot_number))) == 1
+
+    @metrics.timed('db.fetch_image_info_for_blend')
+    def fetch_image_info_for_blend(self, blend_id):
+        with self.statements() as db:
+            result = db.fetchone(queries.FETCH_LATEST_LOT_IMAGE, (blend_id,))
+        pending = self._pending_lots(blend_id)
+        if pending:
+            lot_number = max(pending)
+            if not result or lot_number > result[1]:
+                return pending[lot_number], lot_number
         if result:
             return result[0], result[1]  # image_path, lot_number
         else:
             return None, None
 
-    def fetch_lot_numbers_for_blend(self, blend_id):
-        if not self.use_sqlite:
-            query = "SELECT lot_number FROM lot_images WHERE blend_code = %s ORDER BY lot_number DESC"
-        else:
-            query = "SELECT lot_number FROM lot_images WHERE blend_code = ? ORDER BY lot_number DESC"
-        self.cursor.execute(query, (blend_id,))
-        # Fetch all matching records and extract the lot number of each
-        lot_numbers = [row[0] for row in self.cursor.fetchall()]
-        return lot_numbers
+    @metrics.timed('db.fetch_lot_page')
+    def fetch_lot_page(self, blend_id, before_lot=None, limit=50):
+        ## One page of a blend's lot numbers, newest first: the latest ones, or those below
+        ## before_lot. Seeks on the (blend_code, lot_number) index, so every page costs the
+        ## same however long the blend's history is. Returns (lot_numbers, has_more).
+        with self.statements() as db:
+            # One extra row tells us whether there is another page
+            if before_lot is None:
+                rows = db.fetchall(queries.FETCH_LATEST_LOTS, (blend_id, limit + 1))
+            else:
+                rows = db.fetchall(queries.FETCH_LOTS_BEFORE, (blend_id, int(before_lot), limit + 1))
+        lot_numbers = [row[0] for row in rows]
+        pending = [lot for lot in self._pending_lots(blend_id) if before_lot is None or lot < int(before_lot)]
+        if pending:
+            lot_numbers = sorted(set(lot_numbers) | set(pending), reverse=True)
+        return lot_numbers[:limit], len(lot_numbers) > limit
 
-    def insert_lot_image(self, blend_code, lot_number, image_path):
-        if self.use_sqlite:
-            query = '''INSERT INTO lot_images (blend_code, lot_number, image_path, confirmed_by)
-                       VALUES (?, ?, ?, ?)'''
-            params = (blend_code, lot_number, image_path, "")
-        else:  # For MySQL/MariaDB
-            query = '''INSERT INTO lot_images (blend_code, lot_number, image_path, confirmed_by)
-                       VALUES (%s, %s, %s, %s)'''
-            params = (blend_code, lot_number, image_path, "")
+    @metrics.timed('db.lot_exists')
+    def lot_exists(self, blend_id, lot_number):
+        if int(lot_number) in self._pending_lots(blend_id):
+            return True
+        with self.statements() as db:
+            return db.fetchone(queries.LOT_EXISTS, (blend_id, int(lot_number))) is not None
+
+    @metrics.timed('db.fetch_recent_fingerprints')
+    def fetch_recent_fingerprints(self, blend_id, before_lot, limit=50):
+        ## [(lot_number, fingerprint)] of the latest fingerprinted lots before before_lot, newest first
+        with self.statements() as db:
+            return [(row[0], row[1]) for row in
+                    db.fetchall(queries.FETCH_RECENT_FINGERPRINTS, (blend_id, int(before_lot), limit))]
 
+    @metrics.timed('db.insert_lot_image')
+    def insert_lot_image(self, blend_code, lot_number, image_path, fingerprint=None):
+        if self.journal is not None:
+            try:
+                # One entry per lot, so the replayed upsert can never store a lot twice
+                self.journal.enqueue('insert_lot_image',
+                                     {'blend_code': blend_code, 'lot_number': lot_number, 'image_path': image_path,
+                                      'fingerprint': base64.b64encode(fingerprint).decode('ascii') if fingerprint else None},
+                                     idempotency_key=f"insert_lot_image:{blend_code}:{lot_number}")
+                return
+            except Exception as e:
+                print(f"Couldn't queue lot image locally, writing directly: {e}")
+        params = (blend_code, lot_number, image_path, "", fingerprint)
         try:
-            self.cursor.execute(query, params)
-            self.conn.commit()
+            with self.statements(commit=True) as db:
+                db.execute(queries.INSERT_LOT_IMAGE, params)
         except Exception as e:
             print(f"An error occurred while inserting lot image: {e}")
-            self.conn.rollback()
 
+    @metrics.timed('db.mark_confirmed')
     def mark_confirmed(self, user_initials, blend_code, lot_number):
         print(f"Marking lot {lot_number} as confirmed by {user_initials}")
-        query = '''UPDATE lot_images SET confirmed_by = %s 
-        WHERE blend_code = %s AND lot_number = %s'''
+        if self.journal is not None:
+            try:
+                self.journal.enqueue('mark_confirmed',
+                                     {'user_initials': user_initials, 'blend_code': blend_code, 'lot_number': lot_number},
+                                     idempotency_key=f"mark_confirmed:{blend_code}:{lot_number}")
+                return
+            except Exception as e:
+                print(f"Couldn't queue confirmation locally, writing directly: {e}")
         params = (user_initials, blend_code, lot_number)
         try:
-            self.cursor.execute(query, params)
-            self.conn.commit()
+            with self.statements(commit=True) as db:
+                db.execute(queries.MARK_CONFIRMED, params)
         except Exception as e:
             print(f"Couldn't mark the lot as confirmed... {e}")
-            self.conn.rollback()
-
 
+    @metrics.timed('db.journal_batch')
+    def _apply_journal_batch(self, entries):
+        ## Writes a batch of journal entries to the database in one transaction.
+        ## Every statement is idempotent, so an entry may safely be replayed.
+        with self.statements(commit=True) as db:
+            for _, operation, payload in entries:
+                if operation == 'insert_lot_image':
+                    # Entries queued before fingerprints existed have no 'fingerprint' key
+                    fingerprint = payload.get('fingerprint')
+                    db.execute(queries.UPSERT_LOT_IMAGE,
+                               (payload['blend_code'], payload['lot_number'], payload['image_path'], "",
+                                base64.b64decode(fingerprint) if fingerprint else None))
+                elif operation == 'mark_confirmed':
+                    params = (payload['user_initials'], payload['blend_code'], payload['lot_number'])
+                    if db.execute(queries.MARK_CONFIRMED, params) == 0 and \
+                            db.fetchone(queries.LOT_EXISTS, params[1:]) is None:
+                        # Keep it queued until the lot itself has been written
+                        raise LookupError(f"Lot {payload['lot_number']} of {payload['blend_code']} isn't stored yet")
+                else:
+                    raise ValueError(f"Unknown journal operation {operation}")
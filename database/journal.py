@@ -0,0 +1,159 @@
+import json
+import sqlite3
+import threading
+import uuid
+
+MAX_BACKOFF = 60  # seconds between retries while the external database is unreachable
+
+
+class WriteJournal:
+    """Durable local write-behind queue for lot inserts and confirmations.
+
+    Writes land in a small SQLite file (WAL, fsync on commit) and return at once.
+    A background thread replays them to the external database in batches, in
+    the order they were made, through ``apply_batch(entries)`` - which must apply
+    every entry in one transaction or raise. Entries are deleted only after
+    they have been applied, so nothing is lost if the app or the database goes
+    away in between. Each entry has an idempotency key: re-queuing the same
+    write replaces the pending payload instead of adding a second copy, and
+    ``apply_batch`` uses idempotent statements so replaying an entry is harmless.
+    Replacing a payload bumps the entry's revision, and an entry is only deleted
+    if it is still at the revision that was applied, so a payload replaced
+    mid-flush is written on the next round.
+    Entries that have failed before are retried after the others, so one that
+    keeps failing doesn't hold up the rest. ``is_unavailable(error)`` tells a
+    database that can't be reached apart from an entry it rejected.
+    """
+
+    def __init__(self, path, apply_batch, flush_interval=2, batch_size=50, is_unavailable=None):
+        self.path = path
+        self.apply_batch = apply_batch
+        self.is_unavailable = is_unavailable or (lambda error: False)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS pending_writes (
+                                  id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                  idempotency_key TEXT NOT NULL UNIQUE,
+                                  operation TEXT NOT NULL,
+                                  payload TEXT NOT NULL,
+                                  attempts INTEGER NOT NULL DEFAULT 0,
+                                  last_error TEXT,
+                                  revision INTEGER NOT NULL DEFAULT 0,
+                                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        # Journals written before revisions were tracked
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(pending_writes)")]
+        if 'revision' not in columns:
+            self._conn.execute("ALTER TABLE pending_writes ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+
+    def enqueue(self, operation, payload, idempotency_key=None):
+        key = idempotency_key or f"{operation}:{uuid.uuid4()}"
+        with self._lock:
+            # Keeps the original id (and so the replay order) if the key is already queued
+            self._conn.execute('''INSERT INTO pending_writes (idempotency_key, operation, payload)
+                                  VALUES (?, ?, ?)
+                                  ON CONFLICT(idempotency_key) DO UPDATE SET payload = excluded.payload,
+                                      revision = revision + 1''',
+                               (key, operation, json.dumps(payload)))
+        self._wake.set()
+
+    def pending(self, operation=None):
+        ## Returns [(id, operation, payload)] still waiting to be written, oldest first
+        with self._lock:
+            if operation is None:
+                rows = self._conn.execute("SELECT id, operation, payload FROM pending_writes ORDER BY id").fetchall()
+            else:
+                rows = self._conn.execute('''SELECT id, operation, payload FROM pending_writes
+                                             WHERE operation = ? ORDER BY id''', (operation,)).fetchall()
+        return [(entry_id, op, json.loads(payload)) for entry_id, op, payload in rows]
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-journal", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def flush(self):
+        ## Replays pending entries until the journal is empty or a write fails.
+        ## Returns True when everything was written.
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return True
+            if not self._apply(batch):
+                return False
+
+    def _next_batch(self):
+        ## Returns [(id, operation, payload, revision)]
+        with self._lock:
+            rows = self._conn.execute('''SELECT id, operation, payload, revision FROM pending_writes
+                                         ORDER BY attempts, id LIMIT ?''', (self.batch_size,)).fetchall()
+        return [(entry_id, op, json.loads(payload), revision) for entry_id, op, payload, revision in rows]
+
+    def _apply(self, rows):
+        batch = [row[:3] for row in rows]
+        try:
+            self.apply_batch(batch)
+            self._delete([(row[0], row[3]) for row in rows])
+            return True
+        except Exception as e:
+            batch_error = e
+
+        if self.is_unavailable(batch_error):
+            # Trying each entry on its own would only wait out the reconnect attempts once per entry
+            print(f"Couldn't reach the database for {len(batch)} queued records, will retry: {batch_error}")
+            return False
+        # Find out whether one bad entry is holding the rest back: apply them one
+        # at a time so good entries still get through
+        applied = []
+        for row in rows:
+            try:
+                self.apply_batch([row[:3]])
+                applied.append((row[0], row[3]))
+            except Exception as e:
+                self._record_failure(row[0], e)
+        self._delete(applied)
+        if not applied:
+            print(f"Couldn't write {len(batch)} queued records to the database, will retry: {batch_error}")
+        return len(applied) == len(batch)
+
+    def _delete(self, applied):
+        ## applied is [(id, revision)]; an entry re-queued since it was read keeps its newer payload
+        if not applied:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM pending_writes WHERE id = ? AND revision = ?", applied)
+            self._conn.execute("COMMIT")
+
+    def _record_failure(self, entry_id, error):
+        with self._lock:
+            self._conn.execute('''UPDATE pending_writes SET attempts = attempts + 1, last_error = ?
+                                  WHERE id = ?''', (str(error), entry_id))
+
+    def _run(self):
+        backoff = self.flush_interval
+        while not self._stopping.is_set():
+            if self.flush():
+                backoff = self.flush_interval
+            else:
+                backoff = min(MAX_BACKOFF, backoff * 2)
+            self._wake.wait(backoff)
+            self._wake.clear()
+        # One last attempt so a clean shutdown leaves nothing behind when the database is up
+        self.flush()
@@ -0,0 +1,198 @@
+## Versioned schema migrations.
+## Each migration runs once per database, in order, and the highest applied version
+## is recorded in schema_version. To change the schema, append a new (version, function)
+## pair to MIGRATIONS - never edit one that has already shipped.
+
+MIGRATION_LOCK = 'qc_schema_migration'
+LOCK_TIMEOUT = 60  # seconds to wait for another station to finish migrating
+
+
+def _engine(dialect):
+    return ' ENGINE=InnoDB' if dialect == 'mysql' else ''
+
+
+def _columns(cursor, dialect, table):
+    if dialect == 'sqlite':
+        cursor.execute(f"PRAGMA table_info({table})")
+        return [row[1] for row in cursor.fetchall()]
+    cursor.execute(f"SHOW COLUMNS FROM {table}")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _insert_ignore(dialect):
+    return 'INSERT OR IGNORE' if dialect == 'sqlite' else 'INSERT IGNORE'
+
+
+def _table_exists(cursor, dialect, table):
+    if dialect == 'sqlite':
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    else:
+        cursor.execute("SHOW TABLES LIKE %s", (table,))
+    return cursor.fetchone() is not None
+
+
+def create_base_tables(cursor, dialect):
+    ## The original schema, so databases created by any earlier version start from the same place
+    engine = _engine(dialect)
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS users
+                       (username VARCHAR(255) PRIMARY KEY, pin TEXT){engine}''')
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS blends
+                       (code VARCHAR(255) PRIMARY KEY, product TEXT, tablets_amount INTEGER, kilos_to_produce REAL,
+                        tablet_size VARCHAR(255), tablet_weight REAL){engine}''')
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS lot_images
+                       (blend_code VARCHAR(255), lot_number VARCHAR(255), image_path TEXT, confirmed_by VARCHAR(255),
+                        FOREIGN KEY(blend_code) REFERENCES blends(code)){engine}''')
+
+
+def canonical_lot_images(cursor, dialect):
+    ## Rebuilds lot_images with a surrogate key, an integer lot number and a unique
+    ## (blend_code, lot_number) index. Works from either historical layout, including
+    ## the one from the old create_image_table (id/result columns, no confirmed_by).
+    ## The original table is kept as lot_images_legacy, so rows that couldn't be carried
+    ## over (duplicates, non-numeric lot numbers) are never lost.
+    columns = _columns(cursor, dialect, 'lot_images')
+    if 'created_at' in columns and 'confirmed_at' in columns:
+        # Already rebuilt; MySQL commits DDL as it goes, so an earlier run may have got
+        # this far without recording the version
+        return
+    # Left behind by an earlier run that failed part way (MySQL only, SQLite DDL rolls back)
+    cursor.execute("DROP TABLE IF EXISTS lot_images_new")
+
+    if dialect == 'sqlite':
+        cursor.execute('''CREATE TABLE lot_images_new (
+                              id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              blend_code VARCHAR(255) NOT NULL REFERENCES blends(code),
+                              lot_number INTEGER NOT NULL,
+                              image_path TEXT,
+                              confirmed_by VARCHAR(255) NOT NULL DEFAULT '',
+                              confirmed_at TIMESTAMP NULL,
+                              created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                              UNIQUE (blend_code, lot_number))''')
+    else:
+        cursor.execute('''CREATE TABLE lot_images_new (
+                              id INT AUTO_INCREMENT PRIMARY KEY,
+                              blend_code VARCHAR(255) NOT NULL,
+                              lot_number INT NOT NULL,
+                              image_path TEXT,
+                              confirmed_by VARCHAR(255) NOT NULL DEFAULT '',
+                              confirmed_at TIMESTAMP NULL,
+                              created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                              UNIQUE KEY uq_lot_images_blend_lot (blend_code, lot_number),
+                              FOREIGN KEY (blend_code) REFERENCES blends(code)
+                          ) ENGINE=InnoDB''')
+
+    confirmed_column = 'confirmed_by' if 'confirmed_by' in columns else "''"
+    cursor.execute(f"SELECT blend_code, lot_number, image_path, {confirmed_column} FROM lot_images")
+
+    # Keep one row per lot, preferring a confirmed one, otherwise the latest
+    rows = {}
+    skipped = 0
+    duplicates = 0
+    for blend_code, lot_number, image_path, confirmed_by in cursor.fetchall():
+        try:
+            lot_number = int(str(lot_number).strip())
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        key = (blend_code, lot_number)
+        if key in rows:
+            duplicates += 1
+            if rows[key][3] and not confirmed_by:
+                continue
+        rows[key] = (blend_code, lot_number, image_path, confirmed_by or '')
+
+    legacy_table = 'lot_images_legacy'
+    suffix = 1
+    while _table_exists(cursor, dialect, legacy_table):
+        suffix += 1
+        legacy_table = f'lot_images_legacy_{suffix}'
+    if skipped or duplicates:
+        print(f"{skipped} lot_images rows without a numeric lot number and {duplicates} duplicate rows were "
+              f"not carried over; every original row is kept in {legacy_table}")
+
+    placeholder = '?' if dialect == 'sqlite' else '%s'
+    if rows:
+        cursor.executemany(f'''INSERT INTO lot_images_new (blend_code, lot_number, image_path, confirmed_by)
+                               VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder})''',
+                           list(rows.values()))
+
+    if dialect == 'sqlite':
+        cursor.execute(f"ALTER TABLE lot_images RENAME TO {legacy_table}")
+        cursor.execute("ALTER TABLE lot_images_new RENAME TO lot_images")
+    else:
+        # One atomic statement, so there is never a moment without a lot_images table
+        cursor.execute(f"RENAME TABLE lot_images TO {legacy_table}, lot_images_new TO lot_images")
+
+
+def catalog_version(cursor, dialect):
+    ## Single-row stamp bumped whenever the blends table changes, so stations know
+    ## when their in-memory blend catalog needs reloading.
+    ## Safe to re-run: on MySQL the CREATE commits before the version is recorded.
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS catalog_version
+                       (id INTEGER PRIMARY KEY, version INTEGER NOT NULL){_engine(dialect)}''')
+    cursor.execute(f"{_insert_ignore(dialect)} INTO catalog_version (id, version) VALUES (1, 1)")
+
+
+def lot_sequences(cursor, dialect):
+    ## Per-blend counters for atomic lot number allocation, started from the existing history.
+    ## Safe to re-run, like catalog_version.
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS lot_sequences
+                       (blend_code VARCHAR(255) PRIMARY KEY, last_lot INTEGER NOT NULL){_engine(dialect)}''')
+    cursor.execute(f'''{_insert_ignore(dialect)} INTO lot_sequences (blend_code, last_lot)
+                       SELECT blend_code, MAX(lot_number) FROM lot_images GROUP BY blend_code''')
+
+
+def lot_fingerprints(cursor, dialect):
+    ## Image fingerprint of each lot (see imaging/fingerprint.py), written at upload
+    if 'fingerprint' not in _columns(cursor, dialect, 'lot_images'):
+        cursor.execute("ALTER TABLE lot_images ADD COLUMN fingerprint BLOB NULL")
+
+
+MIGRATIONS = [
+    (1, create_base_tables),
+    (2, canonical_lot_images),
+    (3, catalog_version),
+    (4, lot_sequences),
+    (5, lot_fingerprints),
+]
+
+
+def migrate(db_manager):
+    ## Brings the database up to the latest schema version.
+    ## Stations starting at the same time serialise on a lock, so each migration runs once.
+    dialect = db_manager.dialect
+    placeholder = '?' if dialect == 'sqlite' else '%s'
+    with db_manager.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if dialect == 'sqlite':
+                # Takes the write lock up front; SQLite DDL is transactional, so it's all or nothing
+                cursor.execute("BEGIN IMMEDIATE")
+            else:
+                cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, LOCK_TIMEOUT))
+                if cursor.fetchone()[0] != 1:
+                    raise RuntimeError("Timed out waiting for another station to finish migrating the database")
+
+            cursor.execute(f'''CREATE TABLE IF NOT EXISTS schema_version
+                               (version INTEGER NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP){_engine(dialect)}''')
+            cursor.execute("SELECT MAX(version) FROM schema_version")
+            current = cursor.fetchone()[0] or 0
+
+            for version, migration in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"Migrating database schema to version {version} ({migration.__name__})")
+                migration(cursor, dialect)
+                cursor.execute(f"INSERT INTO schema_version (version) VALUES ({placeholder})", (version,))
+                if dialect == 'mysql':
+                    # MySQL commits DDL implicitly, so record each step as it completes
+                    conn.commit()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if dialect == 'mysql':
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+                cursor.fetchone()
+            cursor.close()
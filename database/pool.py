@@ -0,0 +1,103 @@
+import queue
+import sqlite3
+import time
+
+## Connection pools used by DatabaseManager. Each operation checks a connection
+## out, uses its own cursor and hands the connection back, so background workers
+## and the UI thread never share a cursor or a result set.
+
+ACQUIRE_TIMEOUT = 30  # seconds to wait for a free connection
+RECONNECT_ATTEMPTS = 3
+RECONNECT_DELAY = 1  # seconds between reconnect attempts
+# Client errors for a server that can't be reached or dropped the connection
+CONNECTION_ERRNOS = {2002, 2003, 2006, 2013, 2055}
+
+
+class SQLiteConnectionPool:
+    """Fixed-size pool of SQLite connections that may be used from any thread,
+    one thread at a time."""
+
+    def __init__(self, db_path, pool_size):
+        self.db_path = db_path
+        self._connections = queue.Queue()
+        for _ in range(pool_size):
+            self._connections.put(self._connect())
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=ACQUIRE_TIMEOUT, check_same_thread=False)
+        # WAL lets readers carry on while another connection is writing
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get_connection(self):
+        try:
+            return self._connections.get(timeout=ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f"No free SQLite connection after {ACQUIRE_TIMEOUT}s")
+
+    def begin(self, conn):
+        # sqlite3 opens a transaction implicitly at the first INSERT/UPDATE/DELETE
+        pass
+
+    def release(self, conn):
+        self._connections.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class MySQLConnectionPool:
+    """Wraps mysql.connector's pool with blocking checkout and reconnect retries.
+
+    mysql.connector pings every connection as it is checked out and reconnects
+    it if the server dropped it (e.g. after wait_timeout over a shift change);
+    here a failed reconnect is retried a few times before giving up.
+    """
+
+    def __init__(self, db_config, pool_size):
+        # Imported here so SQLite-only installs don't need the MySQL driver
+        from mysql.connector import errors, pooling
+        self._errors = errors
+        # Autocommit means a plain read never leaves a transaction (and a stale snapshot)
+        # open on a pooled connection; writes start an explicit transaction via begin().
+        # Sessions aren't reset on return, as that would discard cached prepared statements.
+        self._pool = pooling.MySQLConnectionPool(pool_name="qc_pool", pool_size=pool_size,
+                                                 pool_reset_session=False, autocommit=True, **db_config)
+
+    def get_connection(self):
+        deadline = time.monotonic() + ACQUIRE_TIMEOUT
+        reconnect_failures = 0
+        while True:
+            try:
+                return self._pool.get_connection()
+            except self._errors.PoolError:
+                # Every connection is busy, wait for one to come back
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+            except (self._errors.InterfaceError, self._errors.OperationalError) as e:
+                reconnect_failures += 1
+                if reconnect_failures >= RECONNECT_ATTEMPTS:
+                    raise
+                print(f"Database connection lost, reconnecting... {e}")
+                time.sleep(RECONNECT_DELAY)
+
+    def is_connection_error(self, error):
+        ## True when error means the server is unreachable, rather than that a statement failed
+        if isinstance(error, (TimeoutError, self._errors.InterfaceError, self._errors.PoolError)):
+            return True
+        return getattr(error, 'errno', None) in CONNECTION_ERRNOS
+
+    def begin(self, conn):
+        conn.start_transaction()
+
+    def release(self, conn):
+        # Closing a pooled connection returns it to the pool
+        conn.close()
+
+    def close(self):
+        self._pool._remove_connections()
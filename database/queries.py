@@ -0,0 +1,187 @@
+import weakref
+
+ER_UNKNOWN_STMT_HANDLER = 1243  # MySQL error for a prepared statement the server no longer has
+
+## Every statement DatabaseManager runs, written once.
+## Statements use ? placeholders and are rendered with %s for MySQL. Where the
+## dialects genuinely differ (e.g. upsert syntax) a Query takes one text per dialect.
+
+
+class Query:
+    def __init__(self, sql, prepare=True):
+        # sql is a string, or {'sqlite': ..., 'mysql': ...}
+        self._sql = sql
+        self.prepare = prepare
+        self._rendered = {}
+
+    def render(self, dialect):
+        rendered = self._rendered.get(dialect)
+        if rendered is None:
+            sql = self._sql[dialect] if isinstance(self._sql, dict) else self._sql
+            rendered = sql.replace('?', '%s') if dialect == 'mysql' else sql
+            self._rendered[dialect] = rendered
+        return rendered
+
+
+FETCH_ALL_USERS = Query("SELECT username FROM users")
+AUTHENTICATE_USER = Query("SELECT username FROM users WHERE username = ? AND pin = ?")
+
+INSERT_BLEND = Query('''INSERT INTO blends (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight)
+                        VALUES (?, ?, ?, ?, ?, ?)''')
+FETCH_ALL_BLENDS = Query('''SELECT code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight
+                            FROM blends''')
+# Not prepared: executemany on a plain MySQL cursor becomes one multi-row INSERT
+UPSERT_BLENDS = Query({
+    'sqlite': '''INSERT INTO blends (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight)
+                 VALUES (?, ?, ?, ?, ?, ?)
+                 ON CONFLICT(code) DO UPDATE SET product = excluded.product,
+                     tablets_amount = excluded.tablets_amount, kilos_to_produce = excluded.kilos_to_produce,
+                     tablet_size = excluded.tablet_size, tablet_weight = excluded.tablet_weight''',
+    'mysql': '''INSERT INTO blends (code, product, tablets_amount, kilos_to_produce, tablet_size, tablet_weight)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON DUPLICATE KEY UPDATE product = VALUES(product),
+                    tablets_amount = VALUES(tablets_amount), kilos_to_produce = VALUES(kilos_to_produce),
+                    tablet_size = VALUES(tablet_size), tablet_weight = VALUES(tablet_weight)'''
+}, prepare=False)
+
+FETCH_CATALOG_VERSION = Query("SELECT version FROM catalog_version WHERE id = 1")
+BUMP_CATALOG_VERSION = Query("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+
+# Per-blend lot counters; the UPDATE row lock is what serialises concurrent allocations
+SEED_LOT_SEQUENCE = Query({
+    'sqlite': "INSERT OR IGNORE INTO lot_sequences (blend_code, last_lot) VALUES (?, ?)",
+    'mysql': "INSERT IGNORE INTO lot_sequences (blend_code, last_lot) VALUES (?, ?)"
+})
+BUMP_LOT_SEQUENCE = Query("UPDATE lot_sequences SET last_lot = last_lot + 1 WHERE blend_code = ?")
+FETCH_LOT_SEQUENCE = Query("SELECT last_lot FROM lot_sequences WHERE blend_code = ?")
+# Hands a reserved number back, but only while nobody has taken a later one
+RELEASE_LOT_SEQUENCE = Query("UPDATE lot_sequences SET last_lot = last_lot - 1 WHERE blend_code = ? AND last_lot = ?")
+FETCH_LATEST_LOT_IMAGE = Query('''SELECT image_path, lot_number FROM lot_images WHERE blend_code = ?
+                                  ORDER BY lot_number DESC LIMIT 1''')
+# Keyset pages of a blend's lots, newest first, read straight off the (blend_code, lot_number) index
+FETCH_LATEST_LOTS = Query("SELECT lot_number FROM lot_images WHERE blend_code = ? ORDER BY lot_number DESC LIMIT ?")
+FETCH_LOTS_BEFORE = Query('''SELECT lot_number FROM lot_images WHERE blend_code = ? AND lot_number < ?
+                             ORDER BY lot_number DESC LIMIT ?''')
+INSERT_LOT_IMAGE = Query('''INSERT INTO lot_images (blend_code, lot_number, image_path, confirmed_by, fingerprint)
+                            VALUES (?, ?, ?, ?, ?)''')
+# Idempotent form used when replaying the write journal
+UPSERT_LOT_IMAGE = Query({
+    'sqlite': '''INSERT INTO lot_images (blend_code, lot_number, image_path, confirmed_by, fingerprint)
+                 VALUES (?, ?, ?, ?, ?)
+                 ON CONFLICT(blend_code, lot_number) DO UPDATE SET image_path = excluded.image_path,
+                     fingerprint = COALESCE(excluded.fingerprint, fingerprint)''',
+    'mysql': '''INSERT INTO lot_images (blend_code, lot_number, image_path, confirmed_by, fingerprint)
+                VALUES (?, ?, ?, ?, ?)
+                ON DUPLICATE KEY UPDATE image_path = VALUES(image_path),
+                    fingerprint = COALESCE(VALUES(fingerprint), fingerprint)'''
+})
+FETCH_RECENT_FINGERPRINTS = Query('''SELECT lot_number, fingerprint FROM lot_images
+                                     WHERE blend_code = ? AND lot_number < ? AND fingerprint IS NOT NULL
+                                     ORDER BY lot_number DESC LIMIT ?''')
+LOT_EXISTS = Query("SELECT 1 FROM lot_images WHERE blend_code = ? AND lot_number = ?")
+MARK_CONFIRMED = Query('''UPDATE lot_images SET confirmed_by = ?, confirmed_at = CURRENT_TIMESTAMP
+                          WHERE blend_code = ? AND lot_number = ?''')
+
+
+class PreparedStatementCache:
+    """Server-side prepared MySQL cursors, one per (connection, query).
+
+    A prepared cursor re-executes its statement without sending or parsing the
+    SQL again, as long as it is always given the same statement - hence one
+    cursor per query. Keyed weakly on the underlying connection so entries go
+    away with it, and tagged with the server's connection id so a reconnect
+    (which makes the server forget every prepared statement) is noticed.
+    """
+
+    def __init__(self):
+        self._cursors = weakref.WeakKeyDictionary()  # raw connection -> (connection id, {query: cursor})
+
+    def cursor(self, conn, query):
+        raw = getattr(conn, '_cnx', conn)  # unwrap pooled connections
+        connection_id = getattr(raw, 'connection_id', None)
+        entry = self._cursors.get(raw)
+        if entry is None or entry[0] != connection_id:
+            if entry is not None:
+                self._close(entry[1])
+            entry = self._cursors[raw] = (connection_id, {})
+        cursors = entry[1]
+        cursor = cursors.get(query)
+        if cursor is None:
+            cursor = conn.cursor(prepared=True)
+            cursors[query] = cursor
+        return cursor
+
+    def discard(self, conn):
+        # Closes the connection's cursors so their server-side statements are deallocated
+        raw = getattr(conn, '_cnx', conn)
+        entry = self._cursors.pop(raw, None)
+        if entry is not None:
+            self._close(entry[1])
+
+    def _close(self, cursors):
+        for cursor in cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                # The statement is already gone on the server side (e.g. after a reconnect)
+                pass
+
+
+class StatementRunner:
+    """Runs Query objects on one checked-out connection for the active dialect."""
+
+    def __init__(self, conn, dialect, prepared_cache):
+        self.conn = conn
+        self.dialect = dialect
+        self.prepared_cache = prepared_cache
+
+    def _run(self, query, params):
+        sql = query.render(self.dialect)
+        if self.dialect == 'mysql' and query.prepare:
+            cursor = self.prepared_cache.cursor(self.conn, query)
+            try:
+                cursor.execute(sql, params)
+            except Exception as e:
+                # Only a statement the server has forgotten is prepared again, and never inside a
+                # transaction: other errors (e.g. a deadlock) may already have rolled the transaction
+                # back, and re-running on an autocommit connection would commit the rest piecemeal.
+                # Re-raising lets statements() roll back instead.
+                if getattr(e, 'errno', None) != ER_UNKNOWN_STMT_HANDLER or self.conn.in_transaction:
+                    raise
+                self.prepared_cache.discard(self.conn)
+                cursor = self.prepared_cache.cursor(self.conn, query)
+                cursor.execute(sql, params)
+            return cursor, False
+        # SQLite keeps its own per-connection cache of compiled statements
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        return cursor, True
+
+    def fetchall(self, query, params=()):
+        cursor, owned = self._run(query, params)
+        try:
+            return cursor.fetchall()
+        finally:
+            if owned:
+                cursor.close()
+
+    def fetchone(self, query, params=()):
+        # Reads everything so a reused prepared cursor never has unread rows
+        rows = self.fetchall(query, params)
+        return rows[0] if rows else None
+
+    def execute(self, query, params=()):
+        cursor, owned = self._run(query, params)
+        try:
+            return cursor.rowcount
+        finally:
+            if owned:
+                cursor.close()
+
+    def executemany(self, query, rows):
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany(query.render(self.dialect), rows)
+            return cursor.rowcount
+        finally:
+            cursor.close()
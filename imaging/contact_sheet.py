@@ -0,0 +1,151 @@
+import configparser
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from imaging.fetch import fetch_image_bytes
+from imaging.render import overlay_font, render_lot_image
+from instrumentation import metrics
+
+BACKGROUND = (40, 40, 40)
+GAP = 4  # pixels between tiles
+
+
+class ContactSheet:
+    """Builds one composite image tiling the most recent lots of a blend.
+
+    Tiles are downloaded (through the disk cache) and decoded straight to tile
+    size on a thread pool - PIL and socket reads release the GIL, so they run
+    in parallel - and are pasted into the sheet on the Tk main thread as each
+    one finishes, so the sheet fills in progressively. The sheet is the only
+    full-size buffer; tiles are shrunk so it stays within ``max_bytes``.
+    Starting a new sheet (or ``cancel``) abandons the previous one.
+    """
+
+    def __init__(self, dispatcher, cache=None, lot_count=12, columns=4, tile_size=240,
+                 max_bytes=16 * 1024 * 1024, max_workers=12):
+        self.dispatcher = dispatcher
+        self.cache = cache
+        self.lot_count = lot_count
+        self.columns = columns
+        self.tile_size = tile_size
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="contact-sheet")
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._futures = []
+
+    @classmethod
+    def from_config(cls, dispatcher, cache=None, config_path='config.cfg'):
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        return cls(
+            dispatcher, cache,
+            lot_count=config.getint('ContactSheet', 'lots', fallback=12),
+            columns=config.getint('ContactSheet', 'columns', fallback=4),
+            tile_size=config.getint('ContactSheet', 'tile_size', fallback=240),
+            max_bytes=int(config.getfloat('ContactSheet', 'memory_mb', fallback=16) * 1024 * 1024),
+            max_workers=config.getint('ContactSheet', 'workers', fallback=12)
+        )
+
+    def layout(self, count):
+        ## (columns, rows, tile side) for count tiles, shrinking tiles to fit the memory budget
+        columns = max(1, min(self.columns, count))
+        rows = max(1, math.ceil(count / columns))
+        side = self.tile_size
+        # RGB sheet: 3 bytes per pixel
+        while side > 32 and 3 * (columns * (side + GAP)) * (rows * (side + GAP)) > self.max_bytes:
+            side = int(side * 0.9)
+        return columns, rows, side
+
+    def build(self, lots, on_update, on_done=None):
+        """Starts a sheet for ``lots``, a list of (lot_number, url, cache_key), most recent first.
+
+        Called on the Tk main thread. ``on_update(sheet)`` is called with the PIL
+        image straight away (placeholders only) and again after every tile lands;
+        ``on_done()`` once all tiles are in.
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            for future in self._futures:
+                future.cancel()
+            self._futures = []
+
+        columns, rows, side = self.layout(len(lots))
+        sheet = Image.new('RGB', (columns * (side + GAP) + GAP, rows * (side + GAP) + GAP), BACKGROUND)
+        for index, (lot_number, _, _) in enumerate(lots):
+            self._draw_placeholder(sheet, index, columns, side, f"Lot {lot_number}...")
+        on_update(sheet)
+
+        remaining = [len(lots)]
+        for index, (lot_number, url, cache_key) in enumerate(lots):
+            future = self._executor.submit(self._render_tile, generation, lot_number, url, cache_key, side)
+            future.add_done_callback(
+                lambda f, index=index, lot_number=lot_number: self._finished(
+                    generation, sheet, index, lot_number, columns, side, remaining, on_update, on_done, f))
+            with self._lock:
+                self._futures.append(future)
+        if not lots and on_done is not None:
+            on_done()
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+            for future in self._futures:
+                future.cancel()
+            self._futures = []
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _is_current(self, generation):
+        with self._lock:
+            return generation == self._generation
+
+    @metrics.timed('contact_sheet.tile')
+    def _render_tile(self, generation, lot_number, url, cache_key, side):
+        # Runs on a worker thread; returns None once the sheet has been abandoned
+        data = fetch_image_bytes(url, self.cache, cache_key, should_continue=lambda: self._is_current(generation))
+        if data is None or not self._is_current(generation):
+            return None
+        return render_lot_image(data, f"Lot {lot_number}", "white", size=(side, side))
+
+    def _finished(self, generation, sheet, index, lot_number, columns, side, remaining,
+                  on_update, on_done, future):
+        if future.cancelled():
+            return
+        self.dispatcher.call_soon(self._place, generation, sheet, index, lot_number, columns, side,
+                                  remaining, on_update, on_done, future)
+
+    def _place(self, generation, sheet, index, lot_number, columns, side, remaining, on_update, on_done, future):
+        # Runs on the Tk main thread, so the sheet is only ever modified here
+        if not self._is_current(generation):
+            return
+        try:
+            tile = future.result()
+        except Exception as e:
+            print(f"Couldn't load lot {lot_number} for the contact sheet: {e}")
+            self._draw_placeholder(sheet, index, columns, side, f"Lot {lot_number}\nunavailable")
+        else:
+            if tile is None:
+                return
+            x, y = self._cell_origin(index, columns, side)
+            # Tiles keep their aspect ratio, so centre them in the cell
+            sheet.paste(tile, (x + (side - tile.width) // 2, y + (side - tile.height) // 2))
+        remaining[0] -= 1
+        on_update(sheet)
+        if remaining[0] == 0 and on_done is not None:
+            on_done()
+
+    def _cell_origin(self, index, columns, side):
+        row, column = divmod(index, columns)
+        return GAP + column * (side + GAP), GAP + row * (side + GAP)
+
+    def _draw_placeholder(self, sheet, index, columns, side, text):
+        x, y = self._cell_origin(index, columns, side)
+        draw = ImageDraw.Draw(sheet)
+        draw.rectangle((x, y, x + side - 1, y + side - 1), fill=(70, 70, 70))
+        draw.multiline_text((x + 10, y + 10), text, font=overlay_font(), fill="white")
@@ -0,0 +1,50 @@
+import requests
+
+from instrumentation import metrics
+from network import http_client
+
+CHUNK_SIZE = 64 * 1024
+
+
+def fetch_image_bytes(url, cache=None, cache_key=None, should_continue=None):
+    """Returns the image bytes for ``url``, going through the disk cache when one is given.
+
+    Fresh cache entries are served without touching the network. Stale ones are
+    revalidated with If-None-Match / If-Modified-Since, and are still served if
+    the image server can't be reached. Returns None if ``should_continue`` says
+    the caller has lost interest part way through the download.
+    """
+    entry = cache.get(cache_key) if cache is not None and cache_key else None
+    if entry is not None and not cache.is_stale(entry):
+        return entry.data
+
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+    try:
+        with metrics.span('image.fetch'), http_client.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and entry is not None:
+                cache.mark_validated(cache_key)
+                return entry.data
+            response.raise_for_status()
+            chunks = []
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if should_continue is not None and not should_continue():
+                    return None
+                chunks.append(chunk)
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+    except requests.RequestException as e:
+        if entry is not None:
+            print(f"Image server unavailable, using cached copy of {cache_key}: {e}")
+            return entry.data
+        raise
+
+    data = b"".join(chunks)
+    if cache is not None and cache_key:
+        cache.put(cache_key, data, url, etag=etag, last_modified=last_modified)
+    return data
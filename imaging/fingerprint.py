@@ -0,0 +1,126 @@
+from collections import namedtuple
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+## Compact per-lot image fingerprints for comparing a new lot against its predecessors
+## without downloading their images. A fingerprint is a 64-bin colour histogram plus a
+## 64-bit perceptual hash (pHash), stored as one small blob in lot_images.fingerprint.
+## Because every blob has the same fixed layout, the blobs of many lots can be loaded
+## into a single NumPy record array and compared in one vectorised operation.
+
+FINGERPRINT_VERSION = 1
+FINGERPRINT_DTYPE = np.dtype([('version', 'u1'), ('hash', 'u1', 8), ('histogram', '<f4', 64)])
+
+HISTOGRAM_SIZE = (64, 64)  # pixels sampled for the colour histogram
+HASH_SIZE = 32             # pHash input is HASH_SIZE x HASH_SIZE greyscale...
+HASH_BITS_SIDE = 8         # ...of which the lowest 8x8 DCT frequencies become the hash
+HISTOGRAM_WEIGHT = 0.5     # share of colour vs. structure in the combined distance
+
+SimilarityResult = namedtuple('SimilarityResult', ['score', 'baseline', 'flagged', 'closest_lot', 'closest_score',
+                                                   'deviating_lots', 'compared'])
+
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II basis, so the 2-D transform is two matrix products
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_SIZE)
+
+
+def colour_histogram(img):
+    ## Share of pixels in each of 4x4x4 RGB bins
+    pixels = np.asarray(img.convert('RGB').resize(HISTOGRAM_SIZE, Image.Resampling.BILINEAR), dtype=np.uint8)
+    levels = pixels >> 6
+    bins = (levels[..., 0].astype(np.intp) << 4) | (levels[..., 1] << 2) | levels[..., 2]
+    counts = np.bincount(bins.ravel(), minlength=64)
+    return (counts / counts.sum()).astype('<f4')
+
+
+def perceptual_hash(img):
+    ## 64 bits: whether each low-frequency DCT coefficient is above their median
+    grey = np.asarray(img.convert('L').resize((HASH_SIZE, HASH_SIZE), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (_DCT @ grey @ _DCT.T)[:HASH_BITS_SIDE, :HASH_BITS_SIDE].ravel()
+    # The DC term is just overall brightness, so it is left out of the median
+    return np.packbits(low > np.median(low[1:]))
+
+
+def compute_fingerprint(img):
+    record = np.zeros(1, dtype=FINGERPRINT_DTYPE)
+    record['version'] = FINGERPRINT_VERSION
+    record['hash'] = perceptual_hash(img)
+    record['histogram'] = colour_histogram(img)
+    return record.tobytes()
+
+
+def fingerprint_image_bytes(data):
+    ## Fingerprint of an encoded image; JPEGs are decoded at reduced size, which is plenty
+    with Image.open(BytesIO(data)) as img:
+        img.draft('RGB', (HASH_SIZE * 4, HASH_SIZE * 4))
+        return compute_fingerprint(img)
+
+
+def is_current(blob):
+    ## Whether a stored blob has this module's layout and format version
+    return bool(blob) and len(blob) == FINGERPRINT_DTYPE.itemsize and blob[0] == FINGERPRINT_VERSION
+
+
+def load_fingerprints(blobs):
+    ## Stacks stored blobs into one record array, skipping any from another format version
+    usable = [bytes(blob) for blob in blobs if is_current(blob)]
+    return np.frombuffer(b''.join(usable), dtype=FINGERPRINT_DTYPE)
+
+
+def distances(current, history):
+    ## Combined distance (0 = identical, 1 = nothing in common) from one fingerprint
+    ## record to every record in ``history``. Broadcasts, so ``current`` may also be an
+    ## (N, 1) array to get an N x M matrix.
+    colour = 0.5 * np.abs(history['histogram'] - current['histogram']).sum(axis=-1)
+    structure = np.unpackbits(history['hash'] ^ current['hash'], axis=-1).sum(axis=-1) / 64
+    return HISTOGRAM_WEIGHT * colour + (1 - HISTOGRAM_WEIGHT) * structure
+
+
+def score_against_history(current_blob, history, deviation_k=3.0, min_tolerance=0.1):
+    """Compares a lot's fingerprint with earlier lots of the same blend.
+
+    ``history`` is a list of (lot_number, blob), most recent first. The score is
+    the median similarity (0-1) to those lots. What counts as normal comes from
+    the history itself: each earlier lot's median similarity to the others gives
+    the blend's usual level and spread, and anything more than ``deviation_k``
+    robust deviations (at least ``min_tolerance``) below the usual level is
+    flagged - the new lot, and any earlier lots that stand out. Returns None if
+    there are fewer than 3 comparable lots.
+    """
+    current = load_fingerprints([current_blob])
+    # Lots and blobs are filtered together so they stay aligned when some are skipped
+    usable = [(lot, blob) for lot, blob in history if is_current(blob)]
+    lots = [lot for lot, _ in usable]
+    records = load_fingerprints([blob for _, blob in usable])
+    if len(current) != 1 or len(records) < 3:
+        return None
+
+    similarity = 1 - distances(current[0], records)
+    pairwise = 1 - distances(records[:, None], records[None, :])
+    np.fill_diagonal(pairwise, np.nan)
+    typical = np.nanmedian(pairwise, axis=1)
+    baseline = float(np.median(typical))
+    spread = 1.4826 * float(np.median(np.abs(typical - baseline)))
+    threshold = baseline - max(deviation_k * spread, min_tolerance)
+
+    score = float(np.median(similarity))
+    closest = int(np.argmax(similarity))
+    return SimilarityResult(
+        score=score,
+        baseline=baseline,
+        flagged=score < threshold,
+        closest_lot=lots[closest],
+        closest_score=float(similarity[closest]),
+        deviating_lots=[lot for lot, value in zip(lots, typical) if value < threshold],
+        compared=len(lots)
+    )
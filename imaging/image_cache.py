@@ -0,0 +1,132 @@
+import configparser
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CacheEntry = namedtuple('CacheEntry', ['data', 'url', 'etag', 'last_modified', 'validated_at'])
+
+
+def lot_cache_key(blend_code, lot_number):
+    # Blend codes come from a spreadsheet, so keep only filename-safe characters
+    return re.sub(r'[^A-Za-z0-9._-]', '_', f"{blend_code}_{lot_number}")
+
+
+class ImageCache:
+    """Persistent on-disk cache of lot images, keyed by blend and lot number.
+
+    Each entry is stored as ``<key>.img`` with a ``<key>.json`` sidecar holding
+    the ETag / Last-Modified validators. Reads refresh the file's mtime, which
+    gives the least-recently-used order used for eviction once the cache grows
+    past ``max_size_bytes``.
+    """
+
+    def __init__(self, directory, max_size_bytes, revalidate_after_seconds):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.revalidate_after_seconds = revalidate_after_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._total_size = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    @classmethod
+    def from_config(cls, config_path='config.cfg'):
+        ## Returns None when caching is switched off in the config
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        if not config.getboolean('ImageCache', 'enabled', fallback=True):
+            return None
+        return cls(
+            directory=config.get('ImageCache', 'directory', fallback='image_cache'),
+            max_size_bytes=config.getint('ImageCache', 'max_size_mb', fallback=500) * 1024 * 1024,
+            revalidate_after_seconds=config.getfloat('ImageCache', 'revalidate_after_hours', fallback=168) * 3600
+        )
+
+    def _scan(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.img'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            found.append((stat.st_mtime, name[:-len('.img')], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_size += size
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.img', base + '.json'
+
+    def get(self, key):
+        image_path, meta_path = self._paths(key)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            try:
+                with open(image_path, 'rb') as f:
+                    data = f.read()
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+                os.utime(image_path)
+            except (OSError, ValueError):
+                # Half-written or manually removed entry, treat as a miss
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        return CacheEntry(data, meta.get('url'), meta.get('etag'), meta.get('last_modified'),
+                          meta.get('validated_at', 0))
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def is_stale(self, entry):
+        return time.time() - entry.validated_at > self.revalidate_after_seconds
+
+    def put(self, key, data, url, etag=None, last_modified=None):
+        image_path, meta_path = self._paths(key)
+        meta = {'url': url, 'etag': etag, 'last_modified': last_modified, 'validated_at': time.time()}
+        with self._lock:
+            if key in self._entries:
+                self._total_size -= self._entries.pop(key)
+            _write_atomic(image_path, data)
+            _write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+            self._entries[key] = len(data)
+            self._total_size += len(data)
+            self._evict()
+
+    def mark_validated(self, key):
+        # The server answered 304 Not Modified, so the cached copy is good for another period
+        _, meta_path = self._paths(key)
+        with self._lock:
+            try:
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+                meta['validated_at'] = time.time()
+                _write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+            except (OSError, ValueError) as e:
+                print(f"Couldn't update image cache entry {key}: {e}")
+
+    def _evict(self):
+        while self._total_size > self.max_size_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key):
+        self._total_size -= self._entries.pop(key, 0)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
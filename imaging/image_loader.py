@@ -0,0 +1,108 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox
+
+from PIL import ImageTk
+
+from imaging.fetch import fetch_image_bytes
+from imaging.render import render_lot_image
+from instrumentation import metrics
+
+
+class ImageLoader:
+    """Fetches and decodes lot images off the Tk main thread.
+
+    Each label has at most one live request. Starting a new load for a label
+    supersedes the previous one: a queued fetch is cancelled outright, and a
+    fetch already in flight stops downloading and its result is thrown away.
+    """
+
+    def __init__(self, dispatcher, cache=None, photos=None, max_workers=2):
+        self.dispatcher = dispatcher
+        self.cache = cache
+        self.photos = photos
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-loader")
+        self._lock = threading.Lock()
+        self._pending = {}  # label -> (generation, future)
+        self._generation = 0
+
+    def load(self, url, label, overlay_text, overlay_color, cache_key=None, placeholder_text="Loading image..."):
+        photo_key = (url, overlay_text, overlay_color)
+        photo = self.photos.get(photo_key) if self.photos is not None else None
+        if photo is not None:
+            # Already rendered recently, no worker needed
+            self.cancel(label)
+            self._show(label, photo)
+            return
+
+        # Show a placeholder straight away, the image replaces it when ready
+        label.config(image="", text=placeholder_text)
+        label.image = None
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            previous = self._pending.get(label)
+            if previous:
+                previous[1].cancel()
+            future = self._executor.submit(self._fetch_and_render, label, generation, url, cache_key,
+                                         overlay_text, overlay_color)
+            self._pending[label] = (generation, future)
+        future.add_done_callback(lambda f: self._finished(label, generation, photo_key, f))
+
+    def cancel(self, label):
+        with self._lock:
+            previous = self._pending.pop(label, None)
+        if previous:
+            previous[1].cancel()
+            label.config(text="")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _is_current(self, label, generation):
+        with self._lock:
+            current = self._pending.get(label)
+            return current is not None and current[0] == generation
+
+    @metrics.timed('image.load')
+    def _fetch_and_render(self, label, generation, url, cache_key, overlay_text, overlay_color):
+        # Runs on a worker thread; returns None once the request has been superseded
+        data = fetch_image_bytes(url, self.cache, cache_key,
+                                 should_continue=lambda: self._is_current(label, generation))
+        if data is None or not self._is_current(label, generation):
+            return None
+        return render_lot_image(data, overlay_text, overlay_color)
+
+    def _finished(self, label, generation, photo_key, future):
+        if future.cancelled():
+            return
+        self.dispatcher.call_soon(self._deliver, label, generation, photo_key, future)
+
+    def _deliver(self, label, generation, photo_key, future):
+        # Runs on the Tk main thread
+        with self._lock:
+            current = self._pending.get(label)
+            if current is None or current[0] != generation:
+                return  # Stale result, the operator has moved on
+            del self._pending[label]
+
+        error = future.exception()
+        if error is not None:
+            print(f"Error loading image from URL: {error}")
+            label.config(image="", text="")
+            label.image = None
+            messagebox.showerror("Error", f"Failed to load image from URL. {error}")
+            return
+
+        img = future.result()
+        if img is None:
+            return
+        photo = ImageTk.PhotoImage(img)
+        if self.photos is not None:
+            self.photos.put(photo_key, photo)
+        self._show(label, photo)
+
+    @staticmethod
+    def _show(label, photo):
+        label.config(image=photo, text="")
+        label.image = photo  # Keep a reference
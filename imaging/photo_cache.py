@@ -0,0 +1,43 @@
+import configparser
+from collections import OrderedDict
+
+
+class PhotoCache:
+    """Small in-memory LRU of finished PhotoImages, bounded by decoded size.
+
+    Keyed by (url, overlay text, overlay colour) so flipping back to a lot that
+    was just on screen needs no decode at all. PhotoImages belong to Tk, so this
+    is only ever used from the main thread.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._photos = OrderedDict()  # key -> (photo, size in bytes)
+        self._total_bytes = 0
+
+    @classmethod
+    def from_config(cls, config_path='config.cfg'):
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        return cls(config.getint('ImageCache', 'memory_cache_mb', fallback=32) * 1024 * 1024)
+
+    def get(self, key):
+        item = self._photos.get(key)
+        if item is None:
+            return None
+        self._photos.move_to_end(key)
+        return item[0]
+
+    def put(self, key, photo):
+        # Tk keeps decoded photos as 32-bit pixels
+        size = photo.width() * photo.height() * 4
+        if size > self.max_bytes:
+            return
+        old = self._photos.pop(key, None)
+        if old is not None:
+            self._total_bytes -= old[1]
+        self._photos[key] = (photo, size)
+        self._total_bytes += size
+        while self._total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._photos.popitem(last=False)
+            self._total_bytes -= evicted_size
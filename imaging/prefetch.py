@@ -0,0 +1,76 @@
+import configparser
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from imaging.fetch import fetch_image_bytes
+from imaging.image_cache import lot_cache_key
+
+
+class LotPrefetcher:
+    """Warms the disk cache with the most recent lots of the selected blend.
+
+    Operators usually step through the latest few lots after picking a blend,
+    so those are downloaded in the background on a small bounded pool. Picking
+    another blend (or calling ``cancel``) drops everything still queued and
+    makes in-flight downloads stop at their next chunk.
+    """
+
+    def __init__(self, cache, depth=5, max_workers=2):
+        self.cache = cache
+        self.depth = depth
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lot-prefetch")
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._futures = []
+
+    @classmethod
+    def from_config(cls, cache, config_path='config.cfg'):
+        ## Returns None when prefetching is switched off or there is no cache to warm
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        if cache is None or not config.getboolean('Prefetch', 'enabled', fallback=True):
+            return None
+        return cls(
+            cache,
+            depth=config.getint('Prefetch', 'depth', fallback=5),
+            max_workers=config.getint('Prefetch', 'workers', fallback=2)
+        )
+
+    def prefetch(self, blend_id, lots):
+        # lots is a list of (lot_number, url) pairs, most recent first
+        with self._lock:
+            self._cancel_pending()
+            generation = self._generation
+            for lot_number, url in lots[:self.depth]:
+                key = lot_cache_key(blend_id, lot_number)
+                if self.cache.contains(key):
+                    continue
+                self._futures.append(self._executor.submit(self._warm, generation, url, key))
+
+    def cancel(self):
+        with self._lock:
+            self._cancel_pending()
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _cancel_pending(self):
+        # Caller holds the lock
+        self._generation += 1
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+
+    def _is_current(self, generation):
+        with self._lock:
+            return generation == self._generation
+
+    def _warm(self, generation, url, key):
+        if not self._is_current(generation):
+            return
+        try:
+            fetch_image_bytes(url, self.cache, key, should_continue=lambda: self._is_current(generation))
+        except Exception as e:
+            # Prefetching is best effort, the foreground load will report real failures
+            print(f"Couldn't prefetch {key}: {e}")
@@ -0,0 +1,52 @@
+import functools
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+from instrumentation import metrics
+
+DISPLAY_SIZE = (400, 400)
+OVERLAY_FONT_PATH = "arial.ttf"  # Change to the path of your font file if not using a default font
+OVERLAY_FONT_SIZE = 20
+
+
+@metrics.timed('image.render')
+def render_lot_image(data, overlay_text, overlay_color, size=DISPLAY_SIZE):
+    # Decodes the downloaded bytes straight to display size and stamps the overlay.
+    # Pure PIL work, so it is safe to run on a worker thread.
+    img = decode_to_size(data, size)
+    draw_text_overlay(img, overlay_text, overlay_color)
+    return img
+
+
+def decode_to_size(data, size):
+    img = Image.open(BytesIO(data))
+    # For JPEGs, let the decoder scale by 1/2, 1/4 or 1/8 while decoding (DCT scaling),
+    # so a 12 MP phone photo is never fully expanded in memory. No-op for other formats.
+    img.draft('RGB', size)
+    # reducing_gap does a cheap integer reduce first, then LANCZOS for the final step
+    img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+    return img
+
+
+@functools.lru_cache(maxsize=None)
+def overlay_font(font_path=OVERLAY_FONT_PATH, font_size=OVERLAY_FONT_SIZE):
+    # Loaded once per process instead of on every image
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except IOError:
+        print("Default font will be used.")
+        return ImageFont.load_default()
+
+
+def draw_text_overlay(img, overlay_text, overlay_color):
+    draw = ImageDraw.Draw(img)
+
+    # Fixed position for the text, adjust as needed
+    text_x = 10
+    text_y = img.height - 30  # Position at the bottom, adjust as needed
+
+    # Drawing text
+    draw.text((text_x, text_y), overlay_text, font=overlay_font(), fill=overlay_color)
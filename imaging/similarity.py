@@ -0,0 +1,53 @@
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+
+from imaging.fingerprint import score_against_history
+from instrumentation import metrics
+
+
+class SimilarityScorer:
+    """Scores a newly uploaded lot against the blend's recent lots on a worker thread.
+
+    Only stored fingerprints are read - one query for the last ``history`` lots -
+    so no past images are downloaded. ``on_result(result)`` is delivered on the
+    Tk main thread with a SimilarityResult, or None if there is too little
+    history to compare against; ``on_error(exception)`` if scoring failed.
+    """
+
+    def __init__(self, dispatcher, db_manager, history=50, deviation_k=3.0, min_tolerance=0.1):
+        self.dispatcher = dispatcher
+        self.db_manager = db_manager
+        self.history = history
+        self.deviation_k = deviation_k
+        self.min_tolerance = min_tolerance
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="similarity")
+
+    @classmethod
+    def from_config(cls, dispatcher, db_manager, config_path='config.cfg'):
+        ## Returns None when similarity scoring is switched off
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        if not config.getboolean('Similarity', 'enabled', fallback=True):
+            return None
+        return cls(
+            dispatcher, db_manager,
+            history=config.getint('Similarity', 'history', fallback=50),
+            deviation_k=config.getfloat('Similarity', 'deviation_k', fallback=3.0),
+            min_tolerance=config.getfloat('Similarity', 'min_tolerance', fallback=0.1)
+        )
+
+    def score(self, blend_id, lot_number, fingerprint, on_result, on_error):
+        self._executor.submit(self._score, blend_id, lot_number, fingerprint, on_result, on_error)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _score(self, blend_id, lot_number, fingerprint, on_result, on_error):
+        try:
+            with metrics.span('similarity.score'):
+                history = self.db_manager.fetch_recent_fingerprints(blend_id, lot_number, self.history)
+                result = score_against_history(fingerprint, history, self.deviation_k, self.min_tolerance)
+        except Exception as e:
+            self.dispatcher.call_soon(on_error, e)
+            return
+        self.dispatcher.call_soon(on_result, result)
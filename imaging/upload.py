@@ -0,0 +1,150 @@
+import configparser
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from imaging.fingerprint import fingerprint_image_bytes
+from instrumentation import metrics
+from network import http_client
+
+CHUNK_SIZE = 64 * 1024
+
+
+def prepare_upload(file_path, max_dimension, quality):
+    # Shrinks and recompresses a picked photo before it goes over the plant Wi-Fi
+    with Image.open(file_path) as img:
+        # Let the JPEG decoder do most of the downscaling (must happen before load)
+        img.draft('RGB', (max_dimension, max_dimension))
+        # Re-encoding drops EXIF, so bake the phone's orientation into the pixels first
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        out = BytesIO()
+        img.save(out, 'JPEG', quality=quality, optimize=True)
+    filename = os.path.splitext(os.path.basename(file_path))[0] + '.jpg'
+    return filename, out.getvalue()
+
+
+class MultipartBody:
+    """File-like multipart/form-data body that reports progress as it is read.
+
+    requests sends objects with ``read`` and ``__len__`` as a streamed body with
+    a Content-Length, so the socket pulls the payload chunk by chunk and every
+    chunk advances the progress callback.
+    """
+
+    def __init__(self, fields, file_field, filename, payload, content_type='image/jpeg', progress=None):
+        boundary = uuid.uuid4().hex
+        head = b''
+        for name, value in fields.items():
+            head += (f'--{boundary}\r\n'
+                     f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                     f'{value}\r\n').encode('utf-8')
+        head += (f'--{boundary}\r\n'
+                 f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: {content_type}\r\n\r\n').encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        self._parts = [memoryview(head), memoryview(payload), memoryview(tail)]
+        self._total = sum(len(part) for part in self._parts)
+        self._part_index = 0
+        self._offset = 0
+        self._sent = 0
+        self._progress = progress
+
+    def __len__(self):
+        return self._total
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._total
+        size = min(size, CHUNK_SIZE)
+        chunks = []
+        while size > 0 and self._part_index < len(self._parts):
+            part = self._parts[self._part_index]
+            chunk = part[self._offset:self._offset + size]
+            chunks.append(bytes(chunk))
+            size -= len(chunk)
+            self._offset += len(chunk)
+            if self._offset >= len(part):
+                self._part_index += 1
+                self._offset = 0
+        data = b''.join(chunks)
+        self._sent += len(data)
+        if self._progress is not None and data:
+            self._progress(self._sent, self._total)
+        return data
+
+
+class ImageUploader:
+    """Downscales and uploads lot images on a worker thread.
+
+    Callbacks are delivered on the Tk main thread through the dispatcher:
+    ``on_progress(sent, total)`` while the body is streaming, then either
+    ``on_done(image_url, fingerprint)`` or ``on_error(exception)``. The
+    fingerprint (see imaging/fingerprint.py) is None if it couldn't be computed.
+    """
+
+    def __init__(self, dispatcher, max_dimension=2048, quality=85):
+        self.dispatcher = dispatcher
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-upload")
+
+    @classmethod
+    def from_config(cls, dispatcher, config_path='config.cfg'):
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        return cls(
+            dispatcher,
+            max_dimension=config.getint('Upload', 'max_dimension', fallback=2048),
+            quality=config.getint('Upload', 'jpeg_quality', fallback=85)
+        )
+
+    def start(self, file_path, blend_id, lot_number, on_progress, on_done, on_error):
+        self._executor.submit(self._upload, file_path, blend_id, lot_number, on_progress, on_done, on_error)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _upload(self, file_path, blend_id, lot_number, on_progress, on_done, on_error):
+        last_percent = [-1]
+
+        def report(sent, total):
+            # Only bother the UI when the visible percentage changes
+            percent = int(sent * 100 / total)
+            if percent != last_percent[0]:
+                last_percent[0] = percent
+                self.dispatcher.call_soon(on_progress, sent, total)
+
+        try:
+            with metrics.span('upload.prepare'):
+                filename, payload = prepare_upload(file_path, self.max_dimension, self.quality)
+            fingerprint = self._fingerprint(payload)
+            body = MultipartBody({'blend_id': blend_id, 'lot_number': str(lot_number)}, 'image',
+                                 filename, payload, progress=report)
+            with metrics.span('upload.send'):
+                response = http_client.post(http_client.server_url('/upload'), data=body,
+                                            headers={'Content-Type': body.content_type})
+                if response.status_code != 200:
+                    raise RuntimeError(f"Image server answered {response.status_code}")
+            image_url = response.json().get('image_path')
+        except Exception as e:
+            self.dispatcher.call_soon(on_error, e)
+            return
+        self.dispatcher.call_soon(on_done, image_url, fingerprint)
+
+    def _fingerprint(self, payload):
+        # Computed from the downscaled upload, so the image isn't decoded from full size again.
+        # A failure here only costs the similarity check, never the upload.
+        try:
+            with metrics.span('upload.fingerprint'):
+                return fingerprint_image_bytes(payload)
+        except Exception as e:
+            print(f"Couldn't fingerprint the upload: {e}")
+            return None
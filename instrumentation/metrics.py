@@ -0,0 +1,190 @@
+import atexit
+import configparser
+import functools
+import json
+import math
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+## Timing for the paths an operator waits on (database calls, image fetch/decode, uploads).
+## Durations go into small fixed-size histograms per operation, so memory stays bounded
+## however long the app runs. When started, a background thread appends what was recorded
+## since the last write to a JSON-lines file; metrics_report.py turns those files into
+## percentiles per operation and station.
+
+MIN_MS = 0.05      # lower edge of the first bucket
+GROWTH = 2 ** 0.25  # each bucket is ~19% wider than the last, which bounds percentile error
+BUCKET_COUNT = 96   # up to ~14 minutes (0.05 ms * GROWTH ** 96); anything slower lands in the last bucket
+
+_lock = threading.Lock()
+_histograms = {}
+_station = socket.gethostname()
+_writer = None
+
+
+def bucket_index(duration_ms):
+    if duration_ms <= MIN_MS:
+        return 0
+    return min(BUCKET_COUNT - 1, int(math.log(duration_ms / MIN_MS, GROWTH)))
+
+
+def bucket_upper_ms(index):
+    return MIN_MS * GROWTH ** (index + 1)
+
+
+class Histogram:
+    """Log-bucketed latency histogram for one operation."""
+
+    def __init__(self):
+        self.buckets = {}  # bucket index -> count, only buckets that were hit
+        self.count = 0
+        self.errors = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, duration_ms, error=False):
+        index = bucket_index(duration_ms)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        if error:
+            self.errors += 1
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.errors += other.errors
+        self.sum_ms += other.sum_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, q):
+        ## Upper edge of the bucket holding the q-th quantile (0-1), capped at the slowest sample
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(bucket_upper_ms(index), self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {'count': self.count, 'errors': self.errors, 'sum_ms': round(self.sum_ms, 3),
+                'max_ms': round(self.max_ms, 3),
+                'buckets': {str(index): count for index, count in sorted(self.buckets.items())}}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.buckets = {int(index): count for index, count in data['buckets'].items()}
+        histogram.count = data['count']
+        histogram.errors = data.get('errors', 0)
+        histogram.sum_ms = data.get('sum_ms', 0.0)
+        histogram.max_ms = data.get('max_ms', 0.0)
+        return histogram
+
+
+def record(operation, duration_ms, error=False):
+    with _lock:
+        histogram = _histograms.get(operation)
+        if histogram is None:
+            histogram = _histograms[operation] = Histogram()
+        histogram.record(duration_ms, error)
+
+
+@contextmanager
+def span(operation):
+    ## Times the block under ``operation``; an exception counts as an error and is re-raised
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record(operation, (time.perf_counter() - started) * 1000, error=True)
+        raise
+    record(operation, (time.perf_counter() - started) * 1000)
+
+
+def timed(operation):
+    ## Decorator form of span()
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot(reset=False):
+    ## Returns {operation: Histogram} recorded so far (or since the last reset)
+    global _histograms
+    with _lock:
+        if reset:
+            current, _histograms = _histograms, {}
+            return current
+        result = {}
+        for operation, histogram in _histograms.items():
+            result[operation] = Histogram()
+            result[operation].merge(histogram)
+        return result
+
+
+def flush(path, station=None):
+    ## Appends one line per operation with everything recorded since the previous flush
+    recorded = snapshot(reset=True)
+    if not recorded:
+        return
+    timestamp = time.time()
+    lines = [json.dumps(dict(histogram.to_dict(), ts=round(timestamp, 3), station=station or _station,
+                             operation=operation))
+             for operation, histogram in sorted(recorded.items())]
+    try:
+        with open(path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+    except OSError as e:
+        print(f"Couldn't write metrics to {path}: {e}")
+
+
+class _Writer:
+    def __init__(self, path, station, flush_interval):
+        self.path = path
+        self.station = station
+        self.flush_interval = flush_interval
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            flush(self.path, self.station)
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join(5)
+        flush(self.path, self.station)
+
+
+def start(config_path='config.cfg'):
+    ## Starts writing metrics to the file configured in [Metrics]; a no-op when disabled.
+    ## Without this, spans are still recorded in memory (see snapshot()) but never written.
+    global _writer, _station
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    if not config.getboolean('Metrics', 'enabled', fallback=True) or _writer is not None:
+        return
+    _station = config.get('Metrics', 'station', fallback='') or socket.gethostname()
+    _writer = _Writer(config.get('Metrics', 'path', fallback='metrics.jsonl'), _station,
+                      config.getfloat('Metrics', 'flush_interval', fallback=60))
+    atexit.register(stop)
+
+
+def stop():
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
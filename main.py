@@ -1,13 +1,96 @@
+import threading
 import tkinter as tk
-from io import BytesIO
 from tkinter import messagebox, filedialog, ttk, simpledialog
 from tkinter.font import Font
 
-import requests
-from PIL import Image, ImageTk, ImageDraw, ImageFont
 import os
 import csv
 from database.database import DatabaseManager
+from imaging.image_cache import lot_cache_key
+from instrumentation import metrics
+from ui.dispatcher import UiDispatcher
+
+## PIL, requests and the image pipeline aren't needed for the login screen; they are
+## imported on the startup thread (see create_image_services) while the operator signs in.
+
+LOGO_SOURCE = "img/megafood.jpg"
+LOGO_CACHE = "img/megafood_600x200.png"
+LOGO_SIZE = (600, 200)
+RECONNECT_DELAY_MS = 5000
+PENDING_WRITES_POLL_MS = 5000
+LOT_PAGE_SIZE = 50  # lots loaded into the lot selector at a time
+LOAD_OLDER_LOTS = "Load older lots..."
+
+def load_logo():
+    # Tk reads the pre-rendered PNG natively, so normal launches never touch PIL.
+    # It is re-rendered only when missing or older than the source image.
+    if not os.path.exists(LOGO_CACHE) or os.path.getmtime(LOGO_CACHE) < os.path.getmtime(LOGO_SOURCE):
+        from PIL import Image, ImageTk
+        with Image.open(LOGO_SOURCE) as logo_image:
+            resized = logo_image.resize(LOGO_SIZE, Image.Resampling.LANCZOS)
+        try:
+            resized.save(LOGO_CACHE)
+        except OSError as e:
+            # e.g. a read-only install; render it in memory on every launch instead
+            print(f"Couldn't save the resized logo to {LOGO_CACHE}: {e}")
+            return ImageTk.PhotoImage(resized)
+    return tk.PhotoImage(file=LOGO_CACHE)
+
+def create_image_services():
+    from imaging.contact_sheet import ContactSheet
+    from imaging.image_cache import ImageCache
+    from imaging.image_loader import ImageLoader
+    from imaging.photo_cache import PhotoCache
+    from imaging.prefetch import LotPrefetcher
+    from imaging.upload import ImageUploader
+    image_cache = ImageCache.from_config()
+    return (ImageLoader(dispatcher, cache=image_cache, photos=PhotoCache.from_config()),
+            LotPrefetcher.from_config(image_cache),
+            ImageUploader.from_config(dispatcher),
+            ContactSheet.from_config(dispatcher, image_cache))
+
+def start_backend():
+    # Connects in the background so the login screen shows up straight away
+    status_label.config(text="Connecting to the database...")
+    threading.Thread(target=connect_backend, name="startup", daemon=True).start()
+
+def connect_backend():
+    global db_manager, image_loader, prefetcher, uploader, contact_sheet, scorer
+    try:
+        if image_loader is None:
+            image_loader, prefetcher, uploader, contact_sheet = create_image_services()
+        if db_manager is None:
+            db_manager = DatabaseManager()
+            from imaging.similarity import SimilarityScorer
+            scorer = SimilarityScorer.from_config(dispatcher, db_manager)
+        users = load_users()
+        # Loads the blend catalog here too, so the Tk thread never waits on the database for it
+        blend_codes = db_manager.fetch_valid_blends()
+    except Exception as e:
+        dispatcher.call_soon(backend_failed, e)
+        return
+    dispatcher.call_soon(backend_ready, users, blend_codes)
+
+def backend_ready(users, blend_codes):
+    user_dropdown['values'] = users
+    update_blend_dropdown(blend_codes)
+    status_label.config(text="")
+    login_button.config(state=tk.NORMAL)
+
+def backend_failed(error):
+    print(f"Couldn't connect to the database: {error}")
+    status_label.config(text=f"Couldn't connect to the database, retrying... ({error})")
+    app.after(RECONNECT_DELAY_MS, start_backend)
+
+def update_pending_writes():
+    # Warns while uploads or confirmations are queued locally because the database is behind
+    count = db_manager.pending_write_count() if db_manager is not None else 0
+    if count:
+        pending_writes_label.config(text=f"{count} record(s) not yet saved to the database, retrying in the background. "
+                                         "Keep this station running until they are.")
+    else:
+        pending_writes_label.config(text="")
+    app.after(PENDING_WRITES_POLL_MS, update_pending_writes)
 
 def load_users():
     users = db_manager.fetch_all_users()
@@ -73,16 +156,54 @@ def show_blend_selection():
     blend_selection_frame.pack()
 
 
+# Lots currently in the lot selector, newest first, and whether older ones remain
+loaded_lots = []
+older_lots_available = False
+
 def update_lot_selection_dropdown(blend_id):
-    # Fetch lot numbers from the database
-    lot_numbers = db_manager.fetch_lot_numbers_for_blend(blend_id)
+    # Only the most recent page is fetched; older lots are loaded on request
+    global loaded_lots, older_lots_available
+    loaded_lots, older_lots_available = db_manager.fetch_lot_page(blend_id, limit=LOT_PAGE_SIZE)
+    refresh_lot_selection()
 
-    if lot_numbers:
-        # Update the dropdown values with the fetched lot numbers
-        lot_selection['values'] = lot_numbers
-        lot_selection.set(lot_numbers[0])  # Optionally set the first lot number as the default selection
+    if loaded_lots:
+        lot_selection.set(loaded_lots[0])  # Optionally set the first lot number as the default selection
     else:
         lot_selection.set('No lots available')
+    return loaded_lots
+
+def refresh_lot_selection():
+    lot_selection['values'] = loaded_lots + ([LOAD_OLDER_LOTS] if older_lots_available else [])
+
+def load_older_lots(blend_id):
+    # Appends the next page below the oldest loaded lot and returns it
+    global loaded_lots, older_lots_available
+    page, older_lots_available = db_manager.fetch_lot_page(blend_id, before_lot=loaded_lots[-1],
+                                                           limit=LOT_PAGE_SIZE)
+    loaded_lots = loaded_lots + page
+    refresh_lot_selection()
+    return page
+
+def find_lot():
+    # Jumps straight to a lot however far back it is, loading the page it sits on
+    global loaded_lots, older_lots_available
+    blend_id = blend_var.get()
+    try:
+        lot_number = int(find_lot_entry.get().strip())
+    except ValueError:
+        messagebox.showerror("Error", "Enter a lot number to find.")
+        return
+    if lot_number not in loaded_lots:
+        if not db_manager.lot_exists(blend_id, lot_number):
+            messagebox.showinfo("Info", f"Lot {lot_number} wasn't found for blend {blend_id}.")
+            return
+        # The selector restarts at this lot and pages on from there;
+        # reselect the blend to get back to the latest lots
+        loaded_lots, older_lots_available = db_manager.fetch_lot_page(blend_id, before_lot=lot_number + 1,
+                                                                      limit=LOT_PAGE_SIZE)
+        refresh_lot_selection()
+    lot_selection.set(lot_number)
+    load_selected_lot_image()
 
 
 
@@ -90,81 +211,177 @@ def update_lot_selection_dropdown(blend_id):
 def load_blend_data():
     blend_id = blend_var.get()  # Get the selected blend_id from blend_var
     display_blend_info(blend_id)
+    similarity_label.config(text="")
 
     image_path, lot_number = db_manager.fetch_image_info_for_blend(blend_id)
-    update_lot_selection_dropdown(blend_id)
+    lot_numbers = update_lot_selection_dropdown(blend_id)
+    prefetch_recent_lots(blend_id, [lot for lot in lot_numbers if lot != lot_number])
     if image_path and lot_number:
         overlay_text = f"PAST (Lot {lot_number})"
-        load_image_from_url(image_path, last_lot_image_label, overlay_text, "green")
+        load_image_from_url(image_path, last_lot_image_label, overlay_text, "green",
+                            cache_key=lot_cache_key(blend_id, lot_number))
     else:
         messagebox.showinfo("Info", "No past lot image found for this blend.")
 
-def load_image_from_url(url, label, overlay_text, overlay_color):
-    try:
-        response = requests.get(url)
-        img = Image.open(BytesIO(response.content))
-        # Proceed with resizing, drawing overlay text, and displaying the image as before
-        img.thumbnail((400, 400), Image.Resampling.LANCZOS)
-        # Assuming you have a function to draw overlay text on the image
-        draw_text_overlay(img, overlay_text, overlay_color)
-        photo = ImageTk.PhotoImage(img)
-        label.config(image=photo)
-        label.image = photo  # Keep a reference
-    except Exception as e:
-        print(f"Error loading image from URL: {e}")
-        label.config(image="")
-        messagebox.showerror("Error", f"Failed to load image from URL. {e}")
+def prefetch_recent_lots(blend_id, lot_numbers):
+    # Warm the cache with the lots the operator is likely to step through next;
+    # a new call (i.e. a new blend) cancels whatever is still outstanding
+    if prefetcher is not None:
+        prefetcher.prefetch(blend_id, [(lot, lot_image_url(blend_id, lot)) for lot in lot_numbers])
 
-def draw_text_overlay(img, overlay_text, overlay_color):
-    draw = ImageDraw.Draw(img)
-
-    # Specify your font file and size
-    font_path = "arial.ttf"  # Change to the path of your font file if not using a default font
-    font_size = 20
-    try:
-        font = ImageFont.truetype(font_path, font_size)
-    except IOError:
-        print("Default font will be used.")
-        font = ImageFont.load_default()
+def lot_image_url(blend_id, lot_number):
+    from network import http_client
+    return http_client.server_url(f"/images/{blend_id}/{lot_number}")
 
-    # Fixed position for the text, adjust as needed
-    text_x = 10
-    text_y = img.height - 30  # Position at the bottom, adjust as needed
-
-    # Drawing text
-    draw.text((text_x, text_y), overlay_text, font=font, fill=overlay_color)
+def load_image_from_url(url, label, overlay_text, overlay_color, cache_key=None):
+    # Fetching and decoding happen in the background; the label shows a placeholder meanwhile
+    image_loader.load(url, label, overlay_text, overlay_color, cache_key=cache_key)
 
 def upload_image_to_server(blend_id):
-    next_lot_number = db_manager.find_next_lot(blend_id)
-    if next_lot_number == 0:
-        next_lot_number = ask_for_lot_number()
-    if next_lot_number is None:  # User cancelled the operation
-        return
     file_path = filedialog.askopenfilename()
     if file_path:
-        files = {'image': open(file_path, 'rb')}
-        data = {'blend_id': blend_id, 'lot_number': str(next_lot_number)}
-        response = requests.post('http://51.81.166.148:25050/upload', files=files, data=data)
-        if response.status_code == 200:
-            image_url = response.json().get('image_path')
-            overlay_text = f"CURRENT ({next_lot_number})"
-            load_image_from_url(image_url, current_lot_image_label, overlay_text, "red")
-            db_manager.insert_lot_image(blend_id, next_lot_number, image_url)
-            messagebox.showinfo("Success", "Image uploaded successfully")
-            tk.Button(blend_selection_frame, text="Mark as Verified", command=lambda: db_manager.mark_confirmed(user_initials, blend_id, next_lot_number)).pack()
-        else:
-            messagebox.showerror("Error", "Failed to upload image")
+        # The lot number is reserved only once there is something to upload, so a cancelled
+        # dialog doesn't use one up. Allocation is atomic across stations.
+        next_lot_number = reserve_lot_number(blend_id)
+        if next_lot_number is None:
+            return
+        # Resizing and sending happen on a worker; the UI only changes once it's done
+        upload_button.config(state=tk.DISABLED)
+        upload_progress['value'] = 0
+        upload_progress.pack(after=upload_button)
+        uploader.start(
+            file_path, blend_id, next_lot_number,
+            on_progress=lambda sent, total: upload_progress.config(value=sent * 100 / total),
+            on_done=lambda image_url, fingerprint: finish_upload(blend_id, next_lot_number, image_url, fingerprint),
+            on_error=lambda error: upload_failed(blend_id, next_lot_number, error)
+        )
+
+def reserve_lot_number(blend_id):
+    # Returns the next lot number, or None if the operator cancelled or it couldn't be reserved
+    try:
+        lot_number = db_manager.allocate_lot_number(blend_id)
+        if lot_number is None:
+            first_lot = ask_for_lot_number()
+            if first_lot is None:  # User cancelled the operation
+                return None
+            lot_number = db_manager.allocate_lot_number(blend_id, first_lot=first_lot)
+    except Exception as e:
+        # e.g. the database is unreachable, or a deadlock with another station starting the same sequence
+        print(f"Error reserving a lot number for {blend_id}: {e}")
+        messagebox.showerror("Error", f"Couldn't reserve a lot number. Please try again. {e}")
+        return None
+    if lot_number is None:
+        messagebox.showerror("Error", "Couldn't reserve a lot number for this blend. Please try again.")
+    return lot_number
+
+def finish_upload(blend_id, lot_number, image_url, fingerprint):
+    upload_progress.pack_forget()
+    upload_button.config(state=tk.NORMAL)
+    overlay_text = f"CURRENT ({lot_number})"
+    load_image_from_url(image_url, current_lot_image_label, overlay_text, "red",
+                        cache_key=lot_cache_key(blend_id, lot_number))
+    db_manager.insert_lot_image(blend_id, lot_number, image_url, fingerprint)
+    score_similarity(blend_id, lot_number, fingerprint)
+    messagebox.showinfo("Success", "Image uploaded successfully")
+    tk.Button(blend_selection_frame, text="Mark as Verified", command=lambda: db_manager.mark_confirmed(user_initials, blend_id, lot_number)).pack()
+
+def score_similarity(blend_id, lot_number, fingerprint):
+    # Compares the stored fingerprints of recent lots in the background
+    if scorer is None or fingerprint is None:
+        return
+    similarity_label.config(text="Comparing with recent lots...", fg="black")
+    scorer.score(blend_id, lot_number, fingerprint,
+                 on_result=lambda result: show_similarity(blend_id, lot_number, result),
+                 on_error=lambda error: show_similarity_error(blend_id, error))
+
+def show_similarity(blend_id, lot_number, result):
+    if blend_var.get() != blend_id:  # operator has moved on to another blend
+        return
+    if result is None:
+        similarity_label.config(text="Not enough earlier lots with fingerprints to compare against yet.", fg="black")
+        return
+    if result.flagged:
+        text = (f"Lot {lot_number} looks different from recent lots: {result.score:.0%} similar "
+                f"(usually {result.baseline:.0%}). Check it carefully before verifying.")
+        color = "red"
+    else:
+        text = (f"Lot {lot_number} is {result.score:.0%} similar to the last {result.compared} lots "
+                f"(usually {result.baseline:.0%}), closest to lot {result.closest_lot}.")
+        color = "green"
+    if result.deviating_lots:
+        text += "\nEarlier lots that stand out: " + ", ".join(str(lot) for lot in result.deviating_lots)
+    similarity_label.config(text=text, fg=color)
+
+def show_similarity_error(blend_id, error):
+    print(f"Couldn't compare with recent lots: {error}")
+    if blend_var.get() == blend_id:
+        similarity_label.config(text="Couldn't compare with recent lots.", fg="black")
+
+def upload_failed(blend_id, lot_number, error):
+    upload_progress.pack_forget()
+    upload_button.config(state=tk.NORMAL)
+    print(f"Error uploading image: {error}")
+    # Nothing was stored under the reserved number, so hand it back for the retry
+    try:
+        db_manager.release_lot_number(blend_id, lot_number)
+    except Exception as e:
+        print(f"Couldn't release lot {lot_number} of {blend_id}: {e}")
+    messagebox.showerror("Error", f"Failed to upload image. {error}")
 
 
+def show_contact_sheet():
+    # Opens (or refreshes) a window tiling the blend's most recent lots
+    global contact_sheet_window
+    blend_id = blend_var.get()
+    lot_numbers, _ = db_manager.fetch_lot_page(blend_id, limit=contact_sheet.lot_count)
+    if not lot_numbers:
+        messagebox.showinfo("Info", "No past lot images found for this blend.")
+        return
+    if contact_sheet_window is not None and contact_sheet_window.winfo_exists():
+        contact_sheet_window.destroy()
+    contact_sheet_window = window = tk.Toplevel(app)
+    window.title(f"Last {len(lot_numbers)} lots of {blend_id}")
+    sheet_label = tk.Label(window)
+    sheet_label.pack()
+    window.protocol("WM_DELETE_WINDOW", lambda: close_contact_sheet(window))
+    contact_sheet.build([(lot, lot_image_url(blend_id, lot), lot_cache_key(blend_id, lot)) for lot in lot_numbers],
+                        on_update=lambda sheet: update_contact_sheet(sheet_label, sheet))
+
+def update_contact_sheet(sheet_label, sheet):
+    from PIL import ImageTk
+    if not sheet_label.winfo_exists():
+        return
+    photo = getattr(sheet_label, 'photo', None)
+    if photo is None:
+        photo = ImageTk.PhotoImage(sheet)
+        sheet_label.config(image=photo)
+        sheet_label.photo = photo  # keep a reference, as with the lot images
+    else:
+        # Same size every time, so the existing Tk image is updated in place
+        photo.paste(sheet)
+
+def close_contact_sheet(window):
+    contact_sheet.cancel()
+    window.destroy()
+
+def lot_selected():
+    if lot_selection.get() == LOAD_OLDER_LOTS:
+        page = load_older_lots(blend_var.get())
+        if not page:
+            lot_selection.set(loaded_lots[-1])
+            return
+        lot_selection.set(page[0])
+    load_selected_lot_image()
+
 def load_selected_lot_image():
     blend_id = blend_var.get()  # Get the selected blend_id from blend_var
     selected_lot = lot_selection.get()  # Get the selected lot number
-    image_path = f"http://51.81.166.148:25050/images/{blend_id}/{selected_lot}"
-    load_image_from_url(image_path, last_lot_image_label, f"PAST ({selected_lot})", "green")
+    image_path = lot_image_url(blend_id, selected_lot)
+    load_image_from_url(image_path, last_lot_image_label, f"PAST ({selected_lot})", "green",
+                        cache_key=lot_cache_key(blend_id, selected_lot))
 
 
-def update_blend_dropdown():
-    blend_codes = db_manager.fetch_valid_blends()
+def update_blend_dropdown(blend_codes):
     blend_dropdown['values'] = blend_codes
     if blend_codes:
         blend_dropdown.set(blend_codes[0])  # Optionally set the first blend code as the default selection
@@ -180,10 +397,16 @@ def ask_for_lot_number():
 
 
 if __name__ == "__main__":
-    db_manager = DatabaseManager()
+    # Filled in by connect_backend once the database is up
+    db_manager = None
+    image_loader = prefetcher = uploader = contact_sheet = scorer = None
+    contact_sheet_window = None
     # Initialize the main application window
     app = tk.Tk()
     app.title("MegaFood Quality Control - Pressing")
+    dispatcher = UiDispatcher(app)
+    # Appends operation timings to the [Metrics] file, see metrics_report.py
+    metrics.start()
 
     # Set the application to nearly full-screen
     screen_width = app.winfo_screenwidth()
@@ -194,10 +417,12 @@ if __name__ == "__main__":
     headerFont = Font(family="Helvetica", size=12, weight="bold")
 
     # Display the company logo
-    logo_image = Image.open("img/megafood.jpg")
-    logo_photo = ImageTk.PhotoImage(logo_image.resize((600, 200), Image.Resampling.LANCZOS))
+    logo_photo = load_logo()
     logo_label = tk.Label(app, image=logo_photo)
     logo_label.pack()
+    # Shows how many writes are waiting in the local journal, see update_pending_writes
+    pending_writes_label = tk.Label(app, text="", fg="red")
+    pending_writes_label.pack()
 
     # Setup the login frame
     login_frame = tk.Frame(app)
@@ -206,8 +431,7 @@ if __name__ == "__main__":
 
     # User selection dropdown
     user_var = tk.StringVar(login_frame)
-    users = load_users()
-    user_dropdown = ttk.Combobox(login_frame, textvariable=user_var, values=users, state="readonly")
+    user_dropdown = ttk.Combobox(login_frame, textvariable=user_var, state="readonly")
     user_dropdown.pack()
 
     # PIN entry
@@ -215,8 +439,11 @@ if __name__ == "__main__":
     entry_pin = tk.Entry(login_frame, show="*")
     entry_pin.pack()
 
-    # Login button
-    tk.Button(login_frame, text="Login", command=login).pack()
+    # Login button, enabled once the database is connected
+    login_button = tk.Button(login_frame, text="Login", command=login, state=tk.DISABLED)
+    login_button.pack()
+    status_label = tk.Label(login_frame, text="")
+    status_label.pack()
 
     # Setup the blend selection frame
     blend_selection_frame = tk.Frame(app)
@@ -225,16 +452,32 @@ if __name__ == "__main__":
     blend_var = tk.StringVar(blend_selection_frame)
     blend_dropdown = ttk.Combobox(blend_selection_frame, textvariable=blend_var, width=50, state="readonly")
     blend_dropdown.bind('<<ComboboxSelected>>', lambda event, blend_id=blend_var.get(): load_blend_data())
-    update_blend_dropdown()
     blend_dropdown.pack()
 
     lot_selection = ttk.Combobox(blend_selection_frame, width=50, state="readonly")
     lot_selection.pack()
-    lot_selection.bind('<<ComboboxSelected>>', lambda event, blend_id=blend_var.get(): load_selected_lot_image())
+    lot_selection.bind('<<ComboboxSelected>>', lambda event, blend_id=blend_var.get(): lot_selected())
+
+    # Jump to any lot without paging through the history
+    find_lot_frame = tk.Frame(blend_selection_frame)
+    find_lot_frame.pack()
+    tk.Label(find_lot_frame, text="Find lot:").pack(side="left")
+    find_lot_entry = tk.Entry(find_lot_frame, width=12)
+    find_lot_entry.pack(side="left")
+    find_lot_entry.bind('<Return>', lambda event: find_lot())
+    tk.Button(find_lot_frame, text="Go", command=find_lot).pack(side="left")
 
 
     # Upload current lot image button
-    tk.Button(blend_selection_frame, text="Upload Current Lot Image", command=lambda: upload_image_to_server(blend_var.get())).pack()
+    upload_button = tk.Button(blend_selection_frame, text="Upload Current Lot Image", command=lambda: upload_image_to_server(blend_var.get()))
+    upload_button.pack()
+    # Side-by-side view of the blend's most recent lots
+    tk.Button(blend_selection_frame, text="Compare Recent Lots", command=show_contact_sheet).pack()
+    # Shown only while an upload is in progress
+    upload_progress = ttk.Progressbar(blend_selection_frame, length=300, mode="determinate", maximum=100)
+    # Result of comparing the uploaded lot with the blend's recent lots
+    similarity_label = tk.Label(blend_selection_frame, text="", wraplength=600, justify="left")
+    similarity_label.pack()
 
     # Description label for blend information
     # Replace label_description with text_description setup
@@ -261,4 +504,7 @@ if __name__ == "__main__":
 
     last_lot_image_label.pack(side="left")  # Ensure the past lot image label is also correctly positioned.
 
+    # Start connecting once the first frame is on screen
+    app.after_idle(start_backend)
+    app.after(PENDING_WRITES_POLL_MS, update_pending_writes)
     app.mainloop()
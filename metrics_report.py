@@ -0,0 +1,59 @@
+import argparse
+import json
+import time
+
+from instrumentation.metrics import Histogram
+
+## Summarises the JSON-lines files written by instrumentation/metrics.py.
+## Collect metrics.jsonl from each station and run e.g.
+##     python metrics_report.py station1.jsonl station2.jsonl --hours 12
+
+
+def load_histograms(paths, since=None, operation_prefix=None, combine_stations=False):
+    ## Merges every line into {(station, operation): Histogram}
+    merged = {}
+    for path in paths:
+        with open(path) as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    print(f"Skipping unreadable line {line_number} of {path}")
+                    continue
+                if since is not None and entry['ts'] < since:
+                    continue
+                if operation_prefix and not entry['operation'].startswith(operation_prefix):
+                    continue
+                station = 'all' if combine_stations else entry['station']
+                key = (station, entry['operation'])
+                if key not in merged:
+                    merged[key] = Histogram()
+                merged[key].merge(Histogram.from_dict(entry))
+    return merged
+
+
+def print_report(merged):
+    if not merged:
+        print("No metrics recorded.")
+        return
+    header = f"{'station':<16} {'operation':<34} {'count':>7} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for (station, operation), histogram in sorted(merged.items()):
+        print(f"{station:<16} {operation:<34} {histogram.count:>7} {histogram.errors:>6} "
+              f"{histogram.percentile(0.50):>9.1f} {histogram.percentile(0.95):>9.1f} "
+              f"{histogram.percentile(0.99):>9.1f} {histogram.max_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency percentiles per operation and station from metrics files.")
+    parser.add_argument('files', nargs='*', default=['metrics.jsonl'], help="Metrics files (default: metrics.jsonl)")
+    parser.add_argument('--hours', type=float, help="Only include the last N hours")
+    parser.add_argument('--operation', help="Only operations starting with this, e.g. 'db.' or 'image.'")
+    parser.add_argument('--all-stations', action='store_true', help="Combine stations into one row per operation")
+    args = parser.parse_args()
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    print_report(load_histograms(args.files, since, args.operation, args.all_stations))
@@ -0,0 +1,85 @@
+import configparser
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+## Shared HTTP client for the image server. One pooled Session is reused by every
+## thread so image fetches and uploads keep their connections alive.
+
+_lock = threading.Lock()
+_session = None
+_settings = None
+
+
+def load_settings(config_path='config.cfg'):
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    return {
+        'base_url': config.get('ImageServer', 'base_url', fallback='http://51.81.166.148:25050').rstrip('/'),
+        'timeout': (config.getfloat('ImageServer', 'connect_timeout', fallback=5),
+                    config.getfloat('ImageServer', 'read_timeout', fallback=30)),
+        'retries': config.getint('ImageServer', 'retries', fallback=3),
+        'backoff_factor': config.getfloat('ImageServer', 'backoff_factor', fallback=0.5),
+        'pool_size': config.getint('ImageServer', 'pool_size', fallback=16)
+    }
+
+
+def settings():
+    global _settings
+    with _lock:
+        if _settings is None:
+            _settings = load_settings()
+        return _settings
+
+
+def configure(config_path='config.cfg'):
+    # Re-reads the settings and drops the current session, e.g. for a different config file
+    global _settings, _session
+    new_settings = load_settings(config_path)
+    with _lock:
+        _settings = new_settings
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_session():
+    global _session
+    current = settings()
+    with _lock:
+        if _session is None:
+            _session = _build_session(current)
+        return _session
+
+
+def _build_session(current):
+    # Only idempotent requests are retried; an upload is never sent twice behind the operator's back
+    retry = Retry(
+        total=current['retries'],
+        backoff_factor=current['backoff_factor'],
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=current['pool_size'], pool_maxsize=current['pool_size'],
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def server_url(path):
+    return f"{settings()['base_url']}/{path.lstrip('/')}"
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', settings()['timeout'])
+    return get_session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    kwargs.setdefault('timeout', settings()['timeout'])
+    return get_session().post(url, **kwargs)
@@ -0,0 +1,32 @@
+import queue
+
+
+class UiDispatcher:
+    """Runs callbacks on the Tk main loop on behalf of background threads.
+
+    Tk widgets must only be touched from the thread running ``mainloop``, so
+    workers hand their results to ``call_soon`` and the main loop drains the
+    queue every ``poll_interval_ms`` milliseconds via ``app.after``.
+    """
+
+    def __init__(self, root, poll_interval_ms=30):
+        self.root = root
+        self.poll_interval_ms = poll_interval_ms
+        self._queue = queue.Queue()
+        self.root.after(self.poll_interval_ms, self._drain)
+
+    def call_soon(self, callback, *args):
+        # Safe to call from any thread
+        self._queue.put((callback, args))
+
+    def _drain(self):
+        while True:
+            try:
+                callback, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"An error occurred in a UI callback: {e}")
+        self.root.after(self.poll_interval_ms, self._drain)
@@ -1,12 +1,22 @@
+import argparse
 import csv
+import math
+import time
 from database.database import DatabaseManager
-db_manager = DatabaseManager()
 
-def insert_data_from_csv(db_manager):
-    with open('blend_data.csv', mode='r') as infile:
+BLEND_FIELDS = ('code', 'product', 'tablets_amount', 'kilos_to_produce', 'tablet_size', 'tablet_weight')
+
+
+def parse_blend_csv(csv_path='blend_data.csv'):
+    ## Reads the Product Information export into {code: row tuple} in one pass.
+    ## Later rows win if a code appears twice.
+    blends = {}
+    with open(csv_path, mode='r') as infile:
         reader = csv.DictReader(infile)
-        i = 1
         for row in reader:
+            code = (row['Code'] or '').strip()
+            if not code:
+                continue
             # Check for empty string and provide a default value of 0.0 if necessary
             try:
                 kilos_to_produce = float(row['Kilos to Produce']) if row['Kilos to Produce'] else 0.0
@@ -20,25 +30,78 @@ def insert_data_from_csv(db_manager):
                 tablets_amount = int(row['Tablets Amount']) if row['Tablets Amount'] else 0
             except Exception:
                 tablets_amount = 0
-            db_manager.insert_blend(
-                code=row['Code'],
-                product=row['PRODUCT'],
-                tablets_amount=tablets_amount,
-                kilos_to_produce=kilos_to_produce,
-                tablet_size=row['Tablet Size'],
-                tablet_weight=tablet_weight
-            )
-            print(f"[{i}] Inserted or updated information for {row['PRODUCT']}")
-            i += 1
+            blends[code] = (code, row['PRODUCT'], tablets_amount, kilos_to_produce, row['Tablet Size'], tablet_weight)
+    return blends
+
+
+def _same_value(old, new):
+    if isinstance(old, (int, float)) and isinstance(new, (int, float)):
+        return math.isclose(old, new, rel_tol=1e-9, abs_tol=1e-9)
+    return old == new
+
+
+def diff_blends(existing, incoming):
+    ## Returns (new_rows, changed_rows) where changed_rows holds (old, new) pairs
+    new_rows = []
+    changed_rows = []
+    for code, row in incoming.items():
+        old = existing.get(code)
+        if old is None:
+            new_rows.append(row)
+        elif not all(_same_value(a, b) for a, b in zip(old, row)):
+            changed_rows.append((old, row))
+    return new_rows, changed_rows
+
+
+def print_diff_report(new_rows, changed_rows):
+    for row in new_rows:
+        print(f"  + {row[0]} ({row[1]})")
+    for old, new in changed_rows:
+        changes = [f"{field}: {a!r} -> {b!r}" for field, a, b in zip(BLEND_FIELDS, old, new)
+                   if not _same_value(a, b)]
+        print(f"  ~ {new[0]} ({new[1]}): " + ", ".join(changes))
+
+
+def insert_data_from_csv(db_manager, csv_path='blend_data.csv', dry_run=False):
+    ## Writes only new or changed blends, as one batched upsert inside a single transaction
+    started = time.perf_counter()
+    incoming = parse_blend_csv(csv_path)
+    existing = db_manager.fetch_all_blends()
+    new_rows, changed_rows = diff_blends(existing, incoming)
+    print_diff_report(new_rows, changed_rows)
+
+    written = False
+    if not dry_run:
+        written = db_manager.upsert_blends(new_rows + [new for _, new in changed_rows])
+
+    elapsed = time.perf_counter() - started
+    unchanged = len(incoming) - len(new_rows) - len(changed_rows)
+    action = "Would write" if dry_run else ("Wrote" if written else "Failed to write")
+    print(f"{action} {len(new_rows)} new and {len(changed_rows)} changed blends "
+          f"({unchanged} unchanged, {len(incoming)} in CSV) in {elapsed:.2f}s")
+    return {'new': len(new_rows), 'changed': len(changed_rows), 'unchanged': unchanged,
+            'written': written, 'seconds': elapsed}
+
+
 ## Loads new Product Information into the database if there have been changes
 ## You need to 'run' this file individually
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update stored product data from the Product Information CSV.")
+    parser.add_argument('--csv', default='blend_data.csv', help="CSV export to load (default: blend_data.csv)")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would change")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager()
+    if args.dry_run:
+        insert_data_from_csv(db_manager, args.csv, dry_run=True)
+        exit()
     print("This program updates all stored product data based on the contents of 'blend_data.csv'.")
     print("It is expected that you use a copy of the exact Product Information on our spreadsheets...")
+    print("Run with --dry-run first to see exactly what would change.")
     print("Type 'yes' if you're sure you want to continue (there are few fail-safes here if you've messed up!)")
     continue_opt = input("Are you sure? ")
     if continue_opt == "yes":
-        insert_data_from_csv(db_manager)
+        insert_data_from_csv(db_manager, args.csv)
     else:
         print("Exiting.")
         exit("User cancelled operation.")